@@ -6,17 +6,30 @@ Monitors InfluxDB for:
   - Critical low moisture (< 20%)
   - Low battery voltage (< 3.3V)
   - High temperature (> 35°C)
-  - Sensor offline (no data for 5+ minutes)
+  - Sensor offline (no data for 5+ minutes, tracked per known device)
+  - Moisture trends (rapid drop, stuck sensor, variance spike) over a rolling window
 """
 
 import os
 import sys
+import json
 import time
+import heapq
+import queue
 import logging
 import argparse
-from datetime import datetime, timezone
-from influxdb_client import InfluxDBClient
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
+from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
+from sensor_record import (
+    BATTERY_VOLTAGE, DEVICE_ID, MEASUREMENT, SOIL_MOISTURE, SOIL_TEMPERATURE,
+    SensorRecordError, validate_value
+)
+from rollup_service import HOUR_MEASUREMENT, rollup_field
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +39,787 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _flux_time(ts):
+    """Format an aware datetime as a Flux RFC3339 time literal"""
+    return ts.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class WatermarkStore:
+    """Per-field, per-device high-water marks of already processed points"""
+    
+    def __init__(self, path=None):
+        """Load persisted watermarks from path (if given)"""
+        self.path = path
+        self.marks = {}   # {field: {device_id: datetime}}
+        self.newest = {}  # {field: datetime} - newest point ingested for the field, any device
+        self.dirty = False
+        self._load()
+    
+    def _load(self):
+        """Load watermarks from disk, ignoring a missing or corrupt file"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        
+        try:
+            with open(self.path) as f:
+                raw = json.load(f)
+            for field, devices in raw.items():
+                self.marks[field] = {
+                    device_id: datetime.fromisoformat(ts)
+                    for device_id, ts in devices.items()
+                }
+            self.newest = {field: max(devices.values()) for field, devices in self.marks.items() if devices}
+            logger.info(f"Loaded watermarks for {sum(len(d) for d in self.marks.values())} series from {self.path}")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable watermark file {self.path}: {e}")
+            self.marks = {}
+            self.newest = {}
+    
+    def save(self):
+        """Atomically persist watermarks if they changed since the last save"""
+        if not self.path or not self.dirty:
+            return
+        
+        try:
+            raw = {
+                field: {device_id: ts.isoformat() for device_id, ts in devices.items()}
+                for field, devices in self.marks.items()
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(raw, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            logger.error(f"Error saving watermarks to {self.path}: {e}")
+    
+    def devices(self, field):
+        """Return {device_id: watermark} for all known devices of a field"""
+        return dict(self.marks.get(field, {}))
+    
+    def advance(self, field, device_id, ts):
+        """Move a series watermark forward; returns False if ts was already seen"""
+        devices = self.marks.setdefault(field, {})
+        current = devices.get(device_id)
+        if current is not None and ts <= current:
+            return False
+        devices[device_id] = ts
+        newest = self.newest.get(field)
+        if newest is None or ts > newest:
+            self.newest[field] = ts
+        self.dirty = True
+        return True
+    
+    def forget(self, device_id):
+        """Drop all watermarks of a device"""
+        for devices in self.marks.values():
+            if devices.pop(device_id, None) is not None:
+                self.dirty = True
+    
+    def since(self, field, lookback_seconds, lateness_seconds):
+        """Return the query start for a field: newest ingested point minus a lateness allowance, capped to the lookback"""
+        now = datetime.now(timezone.utc)
+        floor = now - timedelta(seconds=lookback_seconds)
+        newest = self.newest.get(field)
+        if newest is None:
+            return floor
+        # Quiet devices don't hold the window back - whatever they send next is newer than this.
+        # A device clock running ahead must not push the window past other devices' points.
+        return max(min(newest, now) - timedelta(seconds=lateness_seconds), floor)
+
+
+class DeviceDeadlines:
+    """Last-seen index with a min-heap of expected next report deadlines"""
+    
+    def __init__(self, timeout_seconds):
+        """Initialize an empty index; devices are overdue timeout_seconds after last report"""
+        self.timeout_seconds = timeout_seconds
+        self.last_seen = {}      # {device_id: epoch seconds of newest report}
+        self.deadlines = {}      # {device_id: epoch seconds after which it is overdue}
+        self.overdue = set()     # Devices already reported as overdue
+        self.recovered = set()   # Overdue devices that reported again
+        self._heap = []          # [(deadline, device_id)] - superseded entries are skipped lazily
+    
+    def __len__(self):
+        return len(self.last_seen)
+    
+    def touch(self, device_id, seen_at):
+        """Record a report from a device (O(log n))"""
+        previous = self.last_seen.get(device_id)
+        if previous is not None and seen_at <= previous:
+            return
+        
+        self.last_seen[device_id] = seen_at
+        deadline = seen_at + self.timeout_seconds
+        self.deadlines[device_id] = deadline
+        heapq.heappush(self._heap, (deadline, device_id))
+        
+        if device_id in self.overdue and deadline > time.time():
+            self.overdue.discard(device_id)
+            self.recovered.add(device_id)
+    
+    def forget(self, device_id):
+        """Stop tracking a device (its heap entries expire lazily)"""
+        self.last_seen.pop(device_id, None)
+        self.deadlines.pop(device_id, None)
+        self.overdue.discard(device_id)
+        self.recovered.discard(device_id)
+    
+    def pop_overdue(self, now):
+        """
+        Return devices whose deadline passed since the last call
+        
+        Returns:
+            list: (device_id, last_seen) tuples, each device reported once per outage
+        """
+        newly_overdue = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, device_id = heapq.heappop(self._heap)
+            if self.deadlines.get(device_id) != deadline:
+                continue  # Superseded by a newer report or postponement, or forgotten
+            if device_id in self.overdue:
+                continue
+            self.overdue.add(device_id)
+            newly_overdue.append((device_id, self.last_seen[device_id]))
+        return newly_overdue
+    
+    def postpone_all(self, not_before):
+        """Move every pending deadline to at least not_before (O(n), e.g. after a data outage)"""
+        for device_id, deadline in self.deadlines.items():
+            if deadline < not_before and device_id not in self.overdue:
+                self.deadlines[device_id] = not_before
+        self._heap = [(deadline, device_id) for device_id, deadline in self.deadlines.items()]
+        heapq.heapify(self._heap)
+    
+    def pop_recovered(self):
+        """Return and reset the set of devices that came back online"""
+        recovered, self.recovered = self.recovered, set()
+        return recovered
+
+
+class TrendWindow:
+    """Fixed-size ring buffer of readings with O(1) rolling statistics"""
+    
+    __slots__ = ('size', 'flat_tolerance', 'times', 'values', 'start', 'count',
+                 'total', 'total_sq', 'origin', 'sum_t', 'sum_tt', 'sum_vt',
+                 'run_anchor', 'run_length')
+    
+    # Regression sums use times relative to origin; re-basing it keeps them precise
+    REBASE_SECONDS = 86400.0
+    
+    def __init__(self, size, flat_tolerance):
+        """Initialize an empty window holding the last size readings"""
+        self.size = size
+        self.flat_tolerance = flat_tolerance
+        self.times = [0.0] * size
+        self.values = [0.0] * size
+        self.start = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.origin = None      # Time origin of the regression sums below
+        self.sum_t = 0.0        # Σ(t - origin)
+        self.sum_tt = 0.0       # Σ(t - origin)²
+        self.sum_vt = 0.0       # Σ value·(t - origin)
+        self.run_anchor = None  # Value the current flat run started at
+        self.run_length = 0     # Consecutive readings within flat_tolerance of run_anchor
+    
+    def add(self, ts, value):
+        """Append a reading, dropping the oldest one when full (O(1))"""
+        if self.origin is None:
+            self.origin = ts
+        
+        if self.count == self.size:
+            oldest = self.values[self.start]
+            offset = self.times[self.start] - self.origin
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+            self.sum_t -= offset
+            self.sum_tt -= offset * offset
+            self.sum_vt -= oldest * offset
+            self.start = (self.start + 1) % self.size
+            self.count -= 1
+        
+        idx = (self.start + self.count) % self.size
+        offset = ts - self.origin
+        self.times[idx] = ts
+        self.values[idx] = value
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        self.sum_t += offset
+        self.sum_tt += offset * offset
+        self.sum_vt += value * offset
+        
+        if offset > self.REBASE_SECONDS:
+            self._rebase()
+        
+        if self.run_anchor is not None and abs(value - self.run_anchor) <= self.flat_tolerance:
+            self.run_length += 1
+        else:
+            self.run_anchor = value
+            self.run_length = 1
+    
+    @property
+    def full(self):
+        return self.count == self.size
+    
+    def stddev(self):
+        """Population standard deviation of the window"""
+        if self.count == 0:
+            return 0.0
+        mean = self.total / self.count
+        return max(0.0, self.total_sq / self.count - mean * mean) ** 0.5
+    
+    def _rebase(self):
+        """Move the time origin to the oldest reading and recompute the regression sums (O(size))"""
+        self.origin = self.times[self.start]
+        self.sum_t = self.sum_tt = self.sum_vt = 0.0
+        for i in range(self.count):
+            idx = (self.start + i) % self.size
+            offset = self.times[idx] - self.origin
+            self.sum_t += offset
+            self.sum_tt += offset * offset
+            self.sum_vt += self.values[idx] * offset
+    
+    def span_seconds(self):
+        """Time between the oldest and newest reading"""
+        if self.count < 2:
+            return 0.0
+        return self.times[(self.start + self.count - 1) % self.size] - self.times[self.start]
+    
+    def rate_per_hour(self):
+        """Least-squares slope of the window in change per hour (0 if undefined)"""
+        if self.count < 2:
+            return 0.0
+        denominator = self.count * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return 0.0
+        return (self.count * self.sum_vt - self.sum_t * self.total) * 3600.0 / denominator
+
+
+class AlertStateTable:
+    """
+    Active alerts per device, stored as a bitset of alert types per device slot
+    
+    Device IDs are interned to slot indexes; freed slots are reused, so memory
+    is bounded by the number of live devices rather than by device churn.
+    """
+    
+    # Last-seen-only changes are snapshotted at most this often (they only drive eviction)
+    SEEN_SAVE_INTERVAL_SECONDS = 600
+    
+    def __init__(self, alert_types, path=None):
+        """Initialize the table, restoring a snapshot from path (if given)"""
+        self.path = path
+        self.alert_types = list(alert_types)
+        self._bits = {alert_type: 1 << i for i, alert_type in enumerate(self.alert_types)}
+        self._index = {}             # {device_id: slot}
+        self._devices = []           # slot -> device_id (None when free)
+        self._active = array('Q')    # slot -> bitset of active alert types
+        self._last_seen = array('d')  # slot -> epoch seconds of last activity
+        self._free = []
+        self.dirty = False
+        self.seen_dirty = False
+        self._saved_at = time.monotonic()
+        self._load()
+        self.dirty = False
+    
+    def __len__(self):
+        return len(self._index)
+    
+    def _bit(self, alert_type):
+        """Return the bit of an alert type, registering unknown types"""
+        bit = self._bits.get(alert_type)
+        if bit is None:
+            if len(self.alert_types) >= 64:
+                raise ValueError(f"Too many alert types to track {alert_type}")
+            bit = 1 << len(self.alert_types)
+            self.alert_types.append(alert_type)
+            self._bits[alert_type] = bit
+        return bit
+    
+    def _slot(self, device_id, now=None):
+        """Return the slot of a device, allocating one if needed"""
+        slot = self._index.get(device_id)
+        if slot is not None:
+            return slot
+        
+        seen = now if now is not None else time.time()
+        if self._free:
+            slot = self._free.pop()
+            self._devices[slot] = device_id
+            self._active[slot] = 0
+            self._last_seen[slot] = seen
+        else:
+            slot = len(self._devices)
+            self._devices.append(device_id)
+            self._active.append(0)
+            self._last_seen.append(seen)
+        self._index[device_id] = slot
+        self.dirty = True
+        return slot
+    
+    def is_active(self, device_id, alert_type):
+        """Return True if the alert is active for the device"""
+        slot = self._index.get(device_id)
+        return slot is not None and bool(self._active[slot] & self._bit(alert_type))
+    
+    def set_active(self, device_id, alert_type, active):
+        """Set or clear an alert; returns True if the state changed"""
+        bit = self._bit(alert_type)
+        if not active and device_id not in self._index:
+            return False
+        
+        slot = self._slot(device_id)
+        bits = self._active[slot]
+        new_bits = bits | bit if active else bits & ~bit
+        if new_bits == bits:
+            return False
+        self._active[slot] = new_bits
+        self.dirty = True
+        return True
+    
+    def active_alerts(self, device_id):
+        """Return the alert types currently active for a device"""
+        slot = self._index.get(device_id)
+        if slot is None:
+            return []
+        bits = self._active[slot]
+        return [alert_type for alert_type, bit in self._bits.items() if bits & bit]
+    
+    def devices_with_alert(self, alert_type):
+        """Return device IDs for which the alert is active"""
+        bit = self._bit(alert_type)
+        return [device_id for device_id, slot in self._index.items() if self._active[slot] & bit]
+    
+    def touch(self, device_id, seen_at):
+        """Record device activity (used for eviction)"""
+        slot = self._slot(device_id, seen_at)
+        if seen_at > self._last_seen[slot]:
+            self._last_seen[slot] = seen_at
+            self.seen_dirty = True
+    
+    def idle_devices(self, now, max_idle_seconds, keep=()):
+        """Return devices without activity for max_idle_seconds"""
+        return [
+            device_id for device_id, slot in self._index.items()
+            if device_id not in keep and now - self._last_seen[slot] > max_idle_seconds
+        ]
+    
+    def forget(self, device_id):
+        """Drop a device and its alert bits, freeing its slot for reuse"""
+        slot = self._index.pop(device_id, None)
+        if slot is None:
+            return
+        self._devices[slot] = None
+        self._active[slot] = 0
+        self._free.append(slot)
+        self.dirty = True
+    
+    def _load(self):
+        """Restore a snapshot, remapping alert types by name"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            saved_types = snapshot['alert_types']
+            for device_id, bits, last_seen in snapshot['devices']:
+                slot = self._slot(device_id, last_seen)
+                for i, alert_type in enumerate(saved_types):
+                    if bits & (1 << i):
+                        self._active[slot] |= self._bit(alert_type)
+            logger.info(f"Restored alert state for {len(self)} devices from {self.path}")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable alert state snapshot {self.path}: {e}")
+            self._index, self._devices, self._free = {}, [], []
+            self._active, self._last_seen = array('Q'), array('d')
+    
+    def save(self, force=False):
+        """Atomically snapshot the table if it changed since the last save"""
+        if not self.path:
+            return
+        seen_due = self.seen_dirty and (
+            force or time.monotonic() - self._saved_at >= self.SEEN_SAVE_INTERVAL_SECONDS)
+        if not self.dirty and not seen_due:
+            return
+        
+        try:
+            snapshot = {
+                'alert_types': self.alert_types,
+                'devices': [
+                    [device_id, self._active[slot], self._last_seen[slot]]
+                    for device_id, slot in self._index.items()
+                ]
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            self.seen_dirty = False
+            self._saved_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error saving alert state to {self.path}: {e}")
+
+
+class AlertWriter:
+    """
+    Batches alert points and writes them from a background thread
+    
+    While InfluxDB is unreachable, points are appended (as line protocol) to a
+    local spill file and replayed in order once writes succeed again, so the
+    checks never block on - or lose alerts to - database outages. With
+    spill=False the writer is best-effort and drops batches it cannot write.
+    """
+    
+    def __init__(self, write_api, bucket, org, spill_path=None, spill=True, kind="alert",
+                 batch_size=500, flush_interval=1.0, retry_interval=15.0):
+        """Initialize and start the writer thread"""
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.spill_path = spill_path
+        self.spill = spill
+        self.kind = kind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        
+        self.points_written = 0
+        self.points_dropped = 0
+        self.write_failures = 0
+        
+        self._queue = queue.Queue()
+        self._memory_spill = []  # Used when no spill path is configured or the spill file is unwritable
+        self._last_replay_attempt = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{kind}-writer", daemon=True)
+        self._thread.start()
+        
+        if self._has_spilled():
+            logger.info(f"Found spilled alerts in {self.spill_path} - they will be replayed")
+    
+    def submit(self, point):
+        """Queue a point dict for writing (never blocks on InfluxDB)"""
+        self._queue.put(Point.from_dict(point).to_line_protocol())
+    
+    def close(self, timeout=10.0):
+        """Flush queued points and stop the writer thread"""
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Alert writer did not stop within {timeout}s - pending alerts may be lost")
+            return
+        
+        # Persist whatever the writer could not deliver before giving up on it
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending or self._memory_spill:
+            self._spill(pending)
+        
+        if self._memory_spill:
+            logger.error(f"Dropping {len(self._memory_spill)} alert points that could not be written or spilled")
+        elif self._has_spilled():
+            logger.warning(f"Alerts still pending after shutdown - kept in {self.spill_path}")
+    
+    def _run(self):
+        """Writer loop: batch queued points, write or spill them, replay spills"""
+        while True:
+            stopping = self._stop.is_set()
+            batch = []
+            try:
+                batch = self._next_batch()
+                
+                if self._has_spilled():
+                    # Keep ordering: new points go behind the spilled ones
+                    if batch:
+                        self._spill(batch)
+                        batch = []
+                    self._replay(force=stopping)
+                elif batch:
+                    if not self._write(batch):
+                        self._spill(batch)
+                    batch = []
+            except Exception as e:
+                logger.error(f"Error in {self.kind} writer loop: {e}")
+                # Keep the batch in hand; it is replayed with the other spilled points
+                if batch:
+                    self._spill(batch)
+                self._last_replay_attempt = time.time()
+            
+            if stopping and self._queue.empty():
+                break
+    
+    def _next_batch(self):
+        """Collect up to batch_size queued lines, waiting at most flush_interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _write(self, lines):
+        """Write a batch of line protocol records; returns False on failure"""
+        try:
+            self.write_api.write(bucket=self.bucket, org=self.org, record=lines)
+            self.points_written += len(lines)
+            return True
+        except Exception as e:
+            self.write_failures += 1
+            logger.error(f"Error writing {len(lines)} {self.kind} points to InfluxDB: {e}")
+            return False
+    
+    def _has_spilled(self):
+        """Return True if there are points waiting to be replayed"""
+        if self._memory_spill:
+            return True
+        return bool(self.spill_path) and os.path.exists(self.spill_path) and os.path.getsize(self.spill_path) > 0
+    
+    def _spill(self, lines):
+        """Append lines to the spill buffer (lines held in memory go to the file first)"""
+        if not self.spill:
+            self.points_dropped += len(lines)
+            return
+        if not self.spill_path:
+            self._memory_spill.extend(lines)
+            return
+        
+        lines = self._memory_spill + lines
+        try:
+            with open(self.spill_path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._memory_spill = []
+            logger.warning(f"Spilled {len(lines)} alert points to {self.spill_path}")
+        except Exception as e:
+            logger.error(f"Error spilling alerts to {self.spill_path} - keeping them in memory: {e}")
+            self._memory_spill = lines
+    
+    def _read_spill(self):
+        """Return all spilled lines in order (in-memory ones after the file)"""
+        lines = []
+        if self.spill_path and os.path.exists(self.spill_path):
+            with open(self.spill_path) as f:
+                lines = [line for line in f.read().split('\n') if line]
+        return lines + self._memory_spill
+    
+    def _replay(self, force=False):
+        """Replay spilled points in order, keeping whatever could not be written"""
+        now = time.time()
+        if not force and now - self._last_replay_attempt < self.retry_interval:
+            return
+        self._last_replay_attempt = now
+        
+        lines = self._read_spill()
+        written = 0
+        while written < len(lines):
+            batch = lines[written:written + self.batch_size]
+            if not self._write(batch):
+                break
+            written += len(batch)
+        
+        remaining = lines[written:]
+        if self.spill_path:
+            try:
+                if remaining:
+                    tmp_path = f"{self.spill_path}.tmp"
+                    with open(tmp_path, 'w') as f:
+                        f.write('\n'.join(remaining) + '\n')
+                    os.replace(tmp_path, self.spill_path)
+                elif os.path.exists(self.spill_path):
+                    os.remove(self.spill_path)
+            except OSError as e:
+                # Leave the spill untouched; re-writing the replayed points is idempotent
+                logger.error(f"Error rewriting {self.spill_path} - keeping all spilled alerts: {e}")
+                return
+            self._memory_spill = []
+        else:
+            self._memory_spill = remaining
+        
+        if written:
+            logger.info(f"Replayed {written} spilled alert points ({len(remaining)} remaining)")
+
+
+class AlertMetrics:
+    """Timing and volume counters of the alert pipeline itself"""
+    
+    MEASUREMENT = "alert_system_metrics"
+    
+    def __init__(self):
+        """Initialize empty per-cycle and cumulative counters"""
+        self._lock = threading.Lock()
+        self._checks = {}   # Current cycle: {check: {'query_seconds', 'rows_scanned', 'eval_seconds', 'errors'}}
+        self._alerts_queued = 0
+        self.last_checks = {}
+        self.last_cycle = {}
+        self.totals = {
+            'cycles': 0,
+            'check_errors': 0,
+            'alerts_queued': 0,
+            'points_written': 0,
+            'write_failures': 0,
+            'cycle_overruns': 0,
+        }
+    
+    def _check(self, check):
+        return self._checks.setdefault(
+            check, {'query_seconds': 0.0, 'rows_scanned': 0, 'eval_seconds': 0.0, 'errors': 0}
+        )
+    
+    def record_query(self, check, seconds, rows):
+        """Record one query issued by a check"""
+        with self._lock:
+            stats = self._check(check)
+            stats['query_seconds'] += seconds
+            stats['rows_scanned'] += rows
+    
+    def record_check(self, check, seconds):
+        """Record the total run time of a check; evaluation time excludes its queries"""
+        with self._lock:
+            stats = self._check(check)
+            stats['eval_seconds'] = max(0.0, seconds - stats['query_seconds'])
+    
+    def record_error(self, check):
+        """Record a failed check"""
+        with self._lock:
+            self._check(check)['errors'] += 1
+            self.totals['check_errors'] += 1
+    
+    def record_alert(self):
+        """Record an alert or resolution queued for writing"""
+        with self._lock:
+            self._alerts_queued += 1
+            self.totals['alerts_queued'] += 1
+    
+    def finish_cycle(self, seconds, points_written, write_failures, cycle_overruns, devices_tracked):
+        """
+        Close the current cycle and return its self-monitoring points
+        
+        Args:
+            points_written, write_failures, cycle_overruns: Cumulative counters
+                of the writer and scheduler
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            checks, self._checks = self._checks, {}
+            alerts_queued, self._alerts_queued = self._alerts_queued, 0
+            
+            self.totals['cycles'] += 1
+            self.totals['points_written'] = points_written
+            self.totals['write_failures'] = write_failures
+            self.totals['cycle_overruns'] = cycle_overruns
+            self.last_checks = checks
+            self.last_cycle = {
+                'cycle_seconds': seconds,
+                'alerts_queued': alerts_queued,
+                'devices_tracked': devices_tracked,
+            }
+            totals = dict(self.totals)
+        
+        points = [
+            {
+                "measurement": self.MEASUREMENT,
+                "tags": {"check": check},
+                "fields": {
+                    "query_ms": stats['query_seconds'] * 1000.0,
+                    "rows_scanned": stats['rows_scanned'],
+                    "eval_ms": stats['eval_seconds'] * 1000.0,
+                    "errors": stats['errors']
+                },
+                "time": now
+            }
+            for check, stats in checks.items()
+        ]
+        points.append({
+            "measurement": self.MEASUREMENT,
+            "tags": {"check": "cycle"},
+            "fields": {
+                "cycle_ms": seconds * 1000.0,
+                "alerts_queued": alerts_queued,
+                "devices_tracked": devices_tracked,
+                "points_written": totals['points_written'],
+                "write_failures": totals['write_failures'],
+                "cycle_overruns": totals['cycle_overruns']
+            },
+            "time": now
+        })
+        return points
+    
+    def render_prometheus(self):
+        """Render the latest cycle and cumulative counters in Prometheus text format"""
+        with self._lock:
+            checks = dict(self.last_checks)
+            cycle = dict(self.last_cycle)
+            totals = dict(self.totals)
+        
+        lines = []
+        for name, key, help_text in (
+            ('alert_check_query_seconds', 'query_seconds', 'Query latency of each check in the last cycle'),
+            ('alert_check_rows_scanned', 'rows_scanned', 'Rows returned to each check in the last cycle'),
+            ('alert_check_eval_seconds', 'eval_seconds', 'Rule evaluation time of each check in the last cycle'),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for check, stats in sorted(checks.items()):
+                lines.append(f'{name}{{check="{check}"}} {stats[key]}')
+        
+        for name, value, help_text in (
+            ('alert_cycle_seconds', cycle.get('cycle_seconds', 0.0), 'Duration of the last monitoring cycle'),
+            ('alert_cycle_alerts_queued', cycle.get('alerts_queued', 0), 'Alerts and resolutions queued in the last cycle'),
+            ('alert_devices_tracked', cycle.get('devices_tracked', 0), 'Devices currently tracked'),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        
+        for key, value in totals.items():
+            name = f"alert_{key}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves AlertMetrics on /metrics"""
+    
+    metrics = None
+    
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request: {format % args}")
+
+
+def start_metrics_server(metrics, port, host='127.0.0.1'):
+    """Expose metrics over HTTP from a background thread"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="alert-metrics", daemon=True).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
+
+
 class AlertSystem:
     """Monitor sensor data and generate alerts for critical conditions"""
     
@@ -36,7 +830,52 @@ class AlertSystem:
     TEMP_HIGH = 35.0
     SENSOR_TIMEOUT_SECONDS = 300  # 5 minutes
     
-    def __init__(self, influxdb_url, token, org, bucket, alert_bucket="alerts"):
+    # Trend detection over the last TREND_WINDOW_SIZE moisture readings per device
+    TREND_WINDOW_SIZE = 12
+    MOISTURE_DROP_RATE = 25.0       # %/hour decline, e.g. a broken pipe draining the field
+    TREND_MIN_SPAN_SECONDS = 600    # Drop rate is only judged over windows spanning at least this long
+    MOISTURE_STDDEV_SPIKE = 8.0     # % standard deviation within the window
+    FLATLINE_TOLERANCE = 0.01       # Readings within this of each other count as unchanged
+    
+    # Incremental queries never look further back than this
+    QUERY_LOOKBACK_SECONDS = 300
+    
+    # Incremental queries start this far before the newest ingested point, covering
+    # Telegraf's collection and flush delay (10s + 10s) and devices reporting out of step
+    QUERY_LATENESS_SECONDS = 60
+    
+    # Startup query window used to seed the set of known devices
+    DEVICE_SEED_LOOKBACK_SECONDS = 7 * 24 * 3600  # 7 days
+    
+    # With hourly rollups available, raw data is only read this far back when seeding
+    DEVICE_SEED_RAW_LOOKBACK_SECONDS = 2 * 3600  # 2 hours
+    
+    # Devices silent for this long are treated as decommissioned and evicted
+    DEVICE_EVICT_SECONDS = 7 * 24 * 3600  # 7 days
+    EVICTION_INTERVAL_SECONDS = 3600
+    
+    # Query-backed checks run concurrently on this many threads
+    CHECK_WORKERS = 3
+    
+    # Late cycles run back to back at most this many times before being skipped
+    MAX_CATCHUP_CYCLES = 3
+    
+    # Pseudo-device used for fleet-wide alerts
+    SYSTEM_DEVICE = "system"
+    
+    ALERT_TYPES = (
+        "LOW_MOISTURE",
+        "CRITICAL_LOW_MOISTURE",
+        "LOW_BATTERY",
+        "HIGH_TEMPERATURE",
+        "SENSOR_OFFLINE",
+        "RAPID_MOISTURE_DROP",
+        "SENSOR_STUCK",
+        "MOISTURE_VARIANCE_SPIKE",
+    )
+    
+    def __init__(self, influxdb_url, token, org, bucket, alert_bucket="alerts", state_dir=None,
+                 rollup_bucket=None):
         """Initialize alert system"""
         self.client = InfluxDBClient(url=influxdb_url, token=token, org=org)
         self.query_api = self.client.query_api()
@@ -44,253 +883,550 @@ class AlertSystem:
         self.org = org
         self.bucket = bucket
         self.alert_bucket = alert_bucket
+        self.rollup_bucket = rollup_bucket
+        
+        # Guards in-memory state shared by concurrently running checks
+        self._state_lock = threading.RLock()
+        self._check_pool = ThreadPoolExecutor(max_workers=self.CHECK_WORKERS, thread_name_prefix="alert-check")
+        self.cycle_overruns = 0
+        
+        # Offline detection pauses while the queries feeding it fail or ingest stalls
+        self._feed_failed = False
+        self._feed_outage_since = None
         
-        # Track alert state to prevent spam
-        self.alert_state = {}
+        # Self-monitoring counters, written to the alert bucket every cycle
+        self.metrics = AlertMetrics()
+        
+        # Persistent state (watermarks etc.) lives in state_dir, if given
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        
+        # Track alert state to prevent spam - snapshotted so restarts don't re-fire alerts
+        self.alert_state = AlertStateTable(self.ALERT_TYPES, self._state_path('alert_state.json'))
+        self._last_eviction = time.time()
+        
+        # Alert points are batched and written in the background
+        self.alert_writer = AlertWriter(
+            self.write_api,
+            bucket=alert_bucket,
+            org=org,
+            spill_path=self._state_path('alert_spill.lp')
+        )
+        # Self-monitoring points are best-effort: never spilled or replayed with the alerts
+        self.metrics_writer = AlertWriter(
+            self.write_api,
+            bucket=alert_bucket,
+            org=org,
+            spill=False,
+            kind="metrics"
+        )
+        
+        # Per-device high-water marks - each check only reads points newer than these
+        self.watermarks = WatermarkStore(self._state_path('watermarks.json'))
+        
+        # Rolling moisture windows for trend alerts
+        self.trend_windows = {}  # {device_id: TrendWindow}
+        
+        # Last-seen index for offline detection, fed by every incremental query
+        self.device_deadlines = DeviceDeadlines(self.SENSOR_TIMEOUT_SECONDS)
+        self._seed_device_deadlines()
+        self._reconcile_offline_alerts()
         
         logger.info(f"Alert system initialized - monitoring bucket: {bucket}")
     
-    def check_soil_moisture(self):
-        """Check for low soil moisture conditions"""
+    def _state_path(self, filename):
+        """Return the path of a persistent state file, or None without a state dir"""
+        if not self.state_dir:
+            return None
+        return os.path.join(self.state_dir, filename)
+    
+    def _seed_device_deadlines(self):
+        """Seed the last-seen index from persisted watermarks and one startup query"""
+        for field in self.watermarks.marks:
+            for device_id, ts in self.watermarks.devices(field).items():
+                self.device_deadlines.touch(device_id, ts.timestamp())
+        
+        # Hourly rollups answer the long lookback cheaply (to the hour); recent raw
+        # data then pins down exact last-seen times
+        raw_lookback = self.DEVICE_SEED_LOOKBACK_SECONDS
+        if self.rollup_bucket:
+            try:
+                seeded = self._seed_from_query(
+                    self.rollup_bucket, HOUR_MEASUREMENT, rollup_field(SOIL_MOISTURE, "count"),
+                    self.DEVICE_SEED_LOOKBACK_SECONDS
+                )
+                if seeded:
+                    raw_lookback = self.DEVICE_SEED_RAW_LOOKBACK_SECONDS
+            except Exception as e:
+                logger.warning(f"Could not seed known devices from rollups, using raw data: {e}")
+        
+        try:
+            self._seed_from_query(self.bucket, MEASUREMENT, SOIL_MOISTURE, raw_lookback)
+        except Exception as e:
+            logger.error(f"Error seeding known devices: {e}")
+        
+        logger.info(f"Tracking {len(self.device_deadlines)} known devices for offline detection")
+    
+    def _seed_from_query(self, bucket, measurement, field, lookback_seconds):
+        """Touch the last-seen index with the newest point per device; returns the device count"""
         query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: -5m)
-          |> filter(fn: (r) => r._measurement == "mqtt_consumer")
-          |> filter(fn: (r) => r._field == "soil_moisture_percent")
+        from(bucket: "{bucket}")
+          |> range(start: -{lookback_seconds}s)
+          |> filter(fn: (r) => r._measurement == "{measurement}")
+          |> filter(fn: (r) => r._field == "{field}")
           |> last()
+          |> keep(columns: ["_time", "_value", "{DEVICE_ID}"])
         '''
         
+        devices = 0
+        for table in self.query_api.query(query):
+            for record in table.records:
+                device_id = record.values.get(DEVICE_ID, 'unknown')
+                self.device_deadlines.touch(device_id, record.get_time().timestamp())
+                devices += 1
+        return devices
+    
+    def _reconcile_offline_alerts(self):
+        """Line up restored SENSOR_OFFLINE alerts with the freshly seeded deadlines"""
+        now = time.time()
+        for device_id in self.alert_state.devices_with_alert("SENSOR_OFFLINE"):
+            if device_id == self.SYSTEM_DEVICE:
+                continue
+            last_seen = self.device_deadlines.last_seen.get(device_id)
+            if last_seen is not None and last_seen + self.SENSOR_TIMEOUT_SECONDS > now:
+                # Came back while the alert system was down
+                self._clear_alert(device_id, "SENSOR_OFFLINE")
+            elif last_seen is not None:
+                self.device_deadlines.overdue.add(device_id)
+    
+    def _evict_decommissioned_devices(self):
+        """Forget devices that stopped reporting long ago, bounding all per-device state"""
+        now = time.time()
+        if now - self._last_eviction < self.EVICTION_INTERVAL_SECONDS:
+            return
+        self._last_eviction = now
+        
+        with self._state_lock:
+            idle = self.alert_state.idle_devices(now, self.DEVICE_EVICT_SECONDS, keep=(self.SYSTEM_DEVICE,))
+            for device_id in idle:
+                # Resolve open alerts so the alerts bucket does not keep them active forever
+                active_alerts = self.alert_state.active_alerts(device_id)
+                for alert_type in active_alerts:
+                    self._clear_alert(device_id, alert_type, message=f"{alert_type} resolved - device decommissioned")
+                
+                self.alert_state.forget(device_id)
+                self.device_deadlines.forget(device_id)
+                self.watermarks.forget(device_id)
+                self.trend_windows.pop(device_id, None)
+                logger.info(f"Evicted decommissioned device {device_id} (resolved alerts: {active_alerts or 'none'})")
+    
+    def _fetch_new_readings(self, field, check, latest_only=True):
+        """
+        Query new points for a field, skipping already seen data
+        
+        Only the range since the newest ingested point (minus QUERY_LATENESS_SECONDS)
+        is scanned, so query cost scales with new data rather than with the lookback
+        window, however many devices are quiet.
+        
+        Args:
+            field: Field to query
+            check: Name of the calling check (for metrics)
+            latest_only: Return only the newest point per device instead of all new points
+        
+        Returns:
+            list: (device_id, time, value) tuples newer than each device's watermark,
+                  in time order per device
+        """
+        since = self.watermarks.since(field, self.QUERY_LOOKBACK_SECONDS, self.QUERY_LATENESS_SECONDS)
+        query = f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: {_flux_time(since)})
+          |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")
+          |> filter(fn: (r) => r._field == "{field}")
+        '''
+        if latest_only:
+            query += '  |> last()\n'
+        
+        readings = []
+        started = time.perf_counter()
         try:
             result = self.query_api.query(query)
+        except Exception:
+            with self._state_lock:
+                self._feed_failed = True
+            raise
+        self.metrics.record_query(check, time.perf_counter() - started, sum(len(table.records) for table in result))
+        
+        with self._state_lock:
             for table in result:
                 for record in table.records:
-                    moisture = record.get_value()
-                    device_id = record.values.get('device_id', 'unknown')
+                    device_id = record.values.get(DEVICE_ID, 'unknown')
+                    record_time = record.get_time()
+                    
+                    if not self.watermarks.advance(field, device_id, record_time):
+                        continue  # Already evaluated in a previous cycle
+                    
+                    try:
+                        value = validate_value(field, record.get_value())
+                    except SensorRecordError as e:
+                        logger.debug(f"Skipping invalid {field} point from {device_id}: {e}")
+                        continue
+                    
+                    self.device_deadlines.touch(device_id, record_time.timestamp())
+                    self.alert_state.touch(device_id, record_time.timestamp())
+                    readings.append((device_id, record_time, value))
+        
+        return readings
+    
+    def check_soil_moisture(self):
+        """Check for low soil moisture conditions and abnormal moisture trends"""
+        try:
+            latest = {}
+            for device_id, record_time, moisture in self._fetch_new_readings(SOIL_MOISTURE, "soil_moisture", latest_only=False):
+                window = self.trend_windows.get(device_id)
+                if window is None:
+                    window = self.trend_windows[device_id] = TrendWindow(self.TREND_WINDOW_SIZE, self.FLATLINE_TOLERANCE)
+                window.add(record_time.timestamp(), moisture)
+                latest[device_id] = moisture
+            
+            for device_id, moisture in latest.items():
+                if moisture < self.MOISTURE_CRITICAL:
+                    self._trigger_alert(
+                        device_id=device_id,
+                        alert_type="CRITICAL_LOW_MOISTURE",
+                        severity="critical",
+                        message=f"Critical: Soil moisture at {moisture:.1f}% (threshold: {self.MOISTURE_CRITICAL}%)",
+                        value=moisture
+                    )
+                elif moisture < self.MOISTURE_LOW:
+                    self._trigger_alert(
+                        device_id=device_id,
+                        alert_type="LOW_MOISTURE",
+                        severity="warning",
+                        message=f"Warning: Soil moisture at {moisture:.1f}% (threshold: {self.MOISTURE_LOW}%)",
+                        value=moisture
+                    )
+                else:
+                    # Clear alert if moisture is back to normal
+                    self._clear_alert(device_id, "LOW_MOISTURE")
+                    self._clear_alert(device_id, "CRITICAL_LOW_MOISTURE")
+                
+                self._check_moisture_trend(device_id, self.trend_windows[device_id])
                     
-                    if moisture < self.MOISTURE_CRITICAL:
-                        self._trigger_alert(
-                            device_id=device_id,
-                            alert_type="CRITICAL_LOW_MOISTURE",
-                            severity="critical",
-                            message=f"Critical: Soil moisture at {moisture:.1f}% (threshold: {self.MOISTURE_CRITICAL}%)",
-                            value=moisture
-                        )
-                    elif moisture < self.MOISTURE_LOW:
-                        self._trigger_alert(
-                            device_id=device_id,
-                            alert_type="LOW_MOISTURE",
-                            severity="warning",
-                            message=f"Warning: Soil moisture at {moisture:.1f}% (threshold: {self.MOISTURE_LOW}%)",
-                            value=moisture
-                        )
-                    else:
-                        # Clear alert if moisture is back to normal
-                        self._clear_alert(device_id, "LOW_MOISTURE")
-                        self._clear_alert(device_id, "CRITICAL_LOW_MOISTURE")
-                        
         except Exception as e:
             logger.error(f"Error checking soil moisture: {e}")
+            self.metrics.record_error("soil_moisture")
+    
+    def _check_moisture_trend(self, device_id, window):
+        """Evaluate rolling-window detectors (rate of drop, flatline, variance) for a device"""
+        if not window.full:
+            return
+        
+        # Over a short span, reading noise and per-reading drift dominate the slope
+        span = window.span_seconds()
+        rate = window.rate_per_hour() if span >= self.TREND_MIN_SPAN_SECONDS else 0.0
+        if rate < -self.MOISTURE_DROP_RATE:
+            self._trigger_alert(
+                device_id=device_id,
+                alert_type="RAPID_MOISTURE_DROP",
+                severity="warning",
+                message=f"Warning: Soil moisture dropping {-rate:.1f}%/h over {span / 60:.0f} min (threshold: {self.MOISTURE_DROP_RATE}%/h)",
+                value=rate
+            )
+        else:
+            self._clear_alert(device_id, "RAPID_MOISTURE_DROP")
+        
+        if window.run_length >= window.size:
+            self._trigger_alert(
+                device_id=device_id,
+                alert_type="SENSOR_STUCK",
+                severity="warning",
+                message=f"Warning: Soil moisture stuck at {window.run_anchor:.2f}% for {window.run_length} readings",
+                value=window.run_anchor
+            )
+        else:
+            self._clear_alert(device_id, "SENSOR_STUCK")
+        
+        stddev = window.stddev()
+        if stddev > self.MOISTURE_STDDEV_SPIKE:
+            self._trigger_alert(
+                device_id=device_id,
+                alert_type="MOISTURE_VARIANCE_SPIKE",
+                severity="warning",
+                message=f"Warning: Soil moisture varies by {stddev:.1f}% over {window.count} readings (threshold: {self.MOISTURE_STDDEV_SPIKE}%)",
+                value=stddev
+            )
+        else:
+            self._clear_alert(device_id, "MOISTURE_VARIANCE_SPIKE")
     
     def check_battery_voltage(self):
         """Check for low battery conditions"""
-        query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: -5m)
-          |> filter(fn: (r) => r._measurement == "mqtt_consumer")
-          |> filter(fn: (r) => r._field == "battery_voltage")
-          |> last()
-        '''
-        
         try:
-            result = self.query_api.query(query)
-            for table in result:
-                for record in table.records:
-                    voltage = record.get_value()
-                    device_id = record.values.get('device_id', 'unknown')
+            for device_id, _, voltage in self._fetch_new_readings(BATTERY_VOLTAGE, "battery_voltage"):
+                if voltage < self.BATTERY_LOW:
+                    self._trigger_alert(
+                        device_id=device_id,
+                        alert_type="LOW_BATTERY",
+                        severity="warning",
+                        message=f"Warning: Battery voltage at {voltage:.2f}V (threshold: {self.BATTERY_LOW}V)",
+                        value=voltage
+                    )
+                else:
+                    self._clear_alert(device_id, "LOW_BATTERY")
                     
-                    if voltage < self.BATTERY_LOW:
-                        self._trigger_alert(
-                            device_id=device_id,
-                            alert_type="LOW_BATTERY",
-                            severity="warning",
-                            message=f"Warning: Battery voltage at {voltage:.2f}V (threshold: {self.BATTERY_LOW}V)",
-                            value=voltage
-                        )
-                    else:
-                        self._clear_alert(device_id, "LOW_BATTERY")
-                        
         except Exception as e:
             logger.error(f"Error checking battery voltage: {e}")
+            self.metrics.record_error("battery_voltage")
     
     def check_temperature(self):
         """Check for high temperature conditions"""
-        query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: -5m)
-          |> filter(fn: (r) => r._measurement == "mqtt_consumer")
-          |> filter(fn: (r) => r._field == "soil_temperature_c")
-          |> last()
-        '''
-        
         try:
-            result = self.query_api.query(query)
-            for table in result:
-                for record in table.records:
-                    temp = record.get_value()
-                    device_id = record.values.get('device_id', 'unknown')
+            for device_id, _, temp in self._fetch_new_readings(SOIL_TEMPERATURE, "temperature"):
+                if temp > self.TEMP_HIGH:
+                    self._trigger_alert(
+                        device_id=device_id,
+                        alert_type="HIGH_TEMPERATURE",
+                        severity="warning",
+                        message=f"Warning: Soil temperature at {temp:.1f}°C (threshold: {self.TEMP_HIGH}°C)",
+                        value=temp
+                    )
+                else:
+                    self._clear_alert(device_id, "HIGH_TEMPERATURE")
                     
-                    if temp > self.TEMP_HIGH:
-                        self._trigger_alert(
-                            device_id=device_id,
-                            alert_type="HIGH_TEMPERATURE",
-                            severity="warning",
-                            message=f"Warning: Soil temperature at {temp:.1f}°C (threshold: {self.TEMP_HIGH}°C)",
-                            value=temp
-                        )
-                    else:
-                        self._clear_alert(device_id, "HIGH_TEMPERATURE")
-                        
         except Exception as e:
             logger.error(f"Error checking temperature: {e}")
+            self.metrics.record_error("temperature")
     
     def check_sensor_online(self):
         """Check if sensors are sending data (not offline)"""
-        query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: -{self.SENSOR_TIMEOUT_SECONDS}s)
-          |> filter(fn: (r) => r._measurement == "mqtt_consumer")
-          |> filter(fn: (r) => r._field == "soil_moisture_percent")
-          |> group(columns: ["device_id"])
-          |> last()
-        '''
-        
         try:
-            result = self.query_api.query(query)
-            if not result or len(result) == 0:
-                # No data at all - sensor might be offline
-                self._trigger_alert(
-                    device_id="system",
-                    alert_type="SENSOR_OFFLINE",
-                    severity="critical",
-                    message=f"Critical: No sensor data received in last {self.SENSOR_TIMEOUT_SECONDS} seconds",
-                    value=0
-                )
-            else:
-                # Check timestamp of last data
-                for table in result:
-                    for record in table.records:
-                        device_id = record.values.get('device_id', 'unknown')
-                        last_time = record.get_time()
-                        time_diff = datetime.now(timezone.utc) - last_time
-                        
-                        if time_diff.total_seconds() > self.SENSOR_TIMEOUT_SECONDS:
-                            self._trigger_alert(
-                                device_id=device_id,
-                                alert_type="SENSOR_OFFLINE",
-                                severity="critical",
-                                message=f"Critical: No data from sensor in {int(time_diff.total_seconds())} seconds",
-                                value=time_diff.total_seconds()
-                            )
-                        else:
-                            self._clear_alert(device_id, "SENSOR_OFFLINE")
-                            
+            with self._state_lock:
+                # Deadlines are fed by the incremental queries of the other checks,
+                # so no range query is needed here
+                now = time.time()
+                
+                # A database or ingest outage must not look like every sensor going offline
+                newest = max((ts.timestamp() for ts in self.watermarks.newest.values()), default=None)
+                stalled = newest is not None and now - newest > self.SENSOR_TIMEOUT_SECONDS
+                if self._feed_failed or stalled:
+                    if self._feed_outage_since is None:
+                        self._feed_outage_since = now
+                        reason = "queries are failing" if self._feed_failed else "no new data is being ingested"
+                        logger.warning(f"Pausing per-device offline detection - {reason}")
+                    if stalled and not self._feed_failed:
+                        self._trigger_alert(
+                            device_id=self.SYSTEM_DEVICE,
+                            alert_type="SENSOR_OFFLINE",
+                            severity="critical",
+                            message=f"Critical: No sensor data received in last {self.SENSOR_TIMEOUT_SECONDS} seconds",
+                            value=0
+                        )
+                    return
+                
+                if self._feed_outage_since is not None:
+                    # Give every device a full timeout to show up in the recovered feed
+                    logger.info(f"Sensor data feed recovered after {now - self._feed_outage_since:.0f}s - "
+                                f"resuming offline detection")
+                    self.device_deadlines.postpone_all(now + self.SENSOR_TIMEOUT_SECONDS)
+                    self._feed_outage_since = None
+                
+                for device_id in self.device_deadlines.pop_recovered():
+                    self._clear_alert(device_id, "SENSOR_OFFLINE")
+                
+                for device_id, last_seen in self.device_deadlines.pop_overdue(now):
+                    silent_seconds = now - last_seen
+                    self._trigger_alert(
+                        device_id=device_id,
+                        alert_type="SENSOR_OFFLINE",
+                        severity="critical",
+                        message=f"Critical: No data from sensor in {int(silent_seconds)} seconds",
+                        value=silent_seconds
+                    )
+                
+                if len(self.device_deadlines) == len(self.device_deadlines.overdue):
+                    # No data at all - every known sensor (if any) is offline
+                    self._trigger_alert(
+                        device_id=self.SYSTEM_DEVICE,
+                        alert_type="SENSOR_OFFLINE",
+                        severity="critical",
+                        message=f"Critical: No sensor data received in last {self.SENSOR_TIMEOUT_SECONDS} seconds",
+                        value=0
+                    )
+                else:
+                    self._clear_alert(self.SYSTEM_DEVICE, "SENSOR_OFFLINE")
+                                
         except Exception as e:
             logger.error(f"Error checking sensor status: {e}")
+            self.metrics.record_error("sensor_online")
     
     def _trigger_alert(self, device_id, alert_type, severity, message, value):
         """Trigger an alert and log to InfluxDB"""
-        alert_key = f"{device_id}_{alert_type}"
-        
-        # Check if this alert is already active
-        if alert_key in self.alert_state and self.alert_state[alert_key]:
-            return  # Alert already active, don't spam
-        
-        # Log alert
-        logger.warning(f"ALERT [{severity.upper()}] {device_id}: {message}")
-        
-        # Write alert to InfluxDB
-        try:
-            point = {
-                "measurement": "alerts",
-                "tags": {
-                    "device_id": device_id,
-                    "alert_type": alert_type,
-                    "severity": severity
-                },
-                "fields": {
-                    "message": message,
-                    "value": float(value),
-                    "active": True
-                },
-                "time": datetime.utcnow()
-            }
-            
-            self.write_api.write(bucket=self.alert_bucket, org=self.org, record=point)
-            self.alert_state[alert_key] = True
+        with self._state_lock:
+            # Check if this alert is already active
+            if self.alert_state.is_active(device_id, alert_type):
+                return  # Alert already active, don't spam
             
-        except Exception as e:
-            logger.error(f"Error writing alert to InfluxDB: {e}")
-    
-    def _clear_alert(self, device_id, alert_type):
-        """Clear an alert when condition is resolved"""
-        alert_key = f"{device_id}_{alert_type}"
-        
-        # Only log if alert was previously active
-        if alert_key in self.alert_state and self.alert_state[alert_key]:
-            logger.info(f"RESOLVED: {device_id} - {alert_type}")
+            # Log alert
+            logger.warning(f"ALERT [{severity.upper()}] {device_id}: {message}")
             
-            # Write resolution to InfluxDB
+            # Queue alert for InfluxDB - delivery is retried from the spill file on failure
             try:
                 point = {
                     "measurement": "alerts",
                     "tags": {
                         "device_id": device_id,
                         "alert_type": alert_type,
-                        "severity": "resolved"
+                        "severity": severity
                     },
                     "fields": {
-                        "message": f"{alert_type} condition resolved",
-                        "value": 0.0,
-                        "active": False
+                        "message": message,
+                        "value": float(value),
+                        "active": True
                     },
                     "time": datetime.utcnow()
                 }
                 
-                self.write_api.write(bucket=self.alert_bucket, org=self.org, record=point)
-                self.alert_state[alert_key] = False
+                self.alert_writer.submit(point)
+                self.alert_state.set_active(device_id, alert_type, True)
+                self.metrics.record_alert()
                 
             except Exception as e:
-                logger.error(f"Error writing alert resolution to InfluxDB: {e}")
+                logger.error(f"Error queueing alert: {e}")
+    
+    def _clear_alert(self, device_id, alert_type, message=None):
+        """Clear an alert when condition is resolved"""
+        with self._state_lock:
+            # Only log if alert was previously active
+            if self.alert_state.is_active(device_id, alert_type):
+                logger.info(f"RESOLVED: {device_id} - {alert_type}")
+                
+                # Queue resolution for InfluxDB
+                try:
+                    point = {
+                        "measurement": "alerts",
+                        "tags": {
+                            "device_id": device_id,
+                            "alert_type": alert_type,
+                            "severity": "resolved"
+                        },
+                        "fields": {
+                            "message": message or f"{alert_type} condition resolved",
+                            "value": 0.0,
+                            "active": False
+                        },
+                        "time": datetime.utcnow()
+                    }
+                    
+                    self.alert_writer.submit(point)
+                    self.alert_state.set_active(device_id, alert_type, False)
+                    self.metrics.record_alert()
+                    
+                except Exception as e:
+                    logger.error(f"Error queueing alert resolution: {e}")
     
     def run_monitoring_cycle(self):
         """Run one complete monitoring cycle"""
         logger.debug("Running monitoring cycle...")
+        cycle_started = time.perf_counter()
+        self._feed_failed = False
+        
+        # Query-backed checks are independent - run them concurrently
+        futures = [
+            self._check_pool.submit(self._timed_check, name, check)
+            for name, check in (
+                ("soil_moisture", self.check_soil_moisture),
+                ("battery_voltage", self.check_battery_voltage),
+                ("temperature", self.check_temperature),
+            )
+        ]
+        for future in futures:
+            future.result()
+        
+        # Offline detection only reads the deadlines fed by the checks above
+        self._timed_check("sensor_online", self.check_sensor_online)
+        
+        self._evict_decommissioned_devices()
         
-        self.check_soil_moisture()
-        self.check_battery_voltage()
-        self.check_temperature()
-        self.check_sensor_online()
+        # Persist progress so a restart resumes without rescanning or re-alerting
+        self.watermarks.save()
+        self.alert_state.save()
         
-        logger.debug("Monitoring cycle complete")
+        cycle_seconds = time.perf_counter() - cycle_started
+        for point in self.metrics.finish_cycle(
+            cycle_seconds,
+            points_written=self.alert_writer.points_written,
+            write_failures=self.alert_writer.write_failures,
+            cycle_overruns=self.cycle_overruns,
+            devices_tracked=len(self.alert_state)
+        ):
+            self.metrics_writer.submit(point)
+        
+        logger.debug(f"Monitoring cycle complete in {cycle_seconds * 1000:.0f}ms")
+    
+    def _timed_check(self, name, check):
+        """Run a check and record its duration"""
+        started = time.perf_counter()
+        check()
+        self.metrics.record_check(name, time.perf_counter() - started)
     
-    def run(self, interval=30):
-        """Run alert system continuously"""
-        logger.info(f"Alert system starting - check interval: {interval}s")
+    def run(self, interval=30, overrun_policy="skip", metrics_port=None):
+        """
+        Run alert system continuously on a fixed-rate schedule
+        
+        Args:
+            interval: Seconds between cycle starts
+            overrun_policy: What to do when a cycle runs past the next deadline -
+                            "skip" drops the missed cycles, "catch-up" runs them
+                            back to back (at most MAX_CATCHUP_CYCLES)
+            metrics_port: Port of the local /metrics endpoint (None or 0 disables it)
+        """
+        logger.info(f"Alert system starting - check interval: {interval}s (overrun policy: {overrun_policy})")
         logger.info(f"Monitoring thresholds:")
         logger.info(f"  - Soil moisture low: {self.MOISTURE_LOW}%")
         logger.info(f"  - Soil moisture critical: {self.MOISTURE_CRITICAL}%")
         logger.info(f"  - Battery low: {self.BATTERY_LOW}V")
         logger.info(f"  - Temperature high: {self.TEMP_HIGH}°C")
         logger.info(f"  - Sensor timeout: {self.SENSOR_TIMEOUT_SECONDS}s")
+        logger.info(f"  - Moisture drop rate: {self.MOISTURE_DROP_RATE}%/h, least-squares over {self.TREND_WINDOW_SIZE} readings "
+                    f"spanning at least {self.TREND_MIN_SPAN_SECONDS // 60} min")
+        logger.info(f"  - Moisture variance spike: {self.MOISTURE_STDDEV_SPIKE}% stddev")
+        
+        metrics_server = None
+        if metrics_port:
+            try:
+                metrics_server = start_metrics_server(self.metrics, metrics_port)
+            except OSError as e:
+                logger.error(f"Failed to start metrics endpoint on port {metrics_port}: {e}")
         
         try:
+            next_run = time.monotonic()
             while True:
                 self.run_monitoring_cycle()
-                time.sleep(interval)
+                
+                next_run += interval
+                behind = time.monotonic() - next_run
+                if behind > 0:
+                    self.cycle_overruns += 1
+                    missed = int(behind // interval) + 1
+                    if overrun_policy == "catch-up" and missed <= self.MAX_CATCHUP_CYCLES:
+                        logger.warning(f"Monitoring cycle overran by {behind:.1f}s - catching up {missed} cycle(s)")
+                    else:
+                        next_run += missed * interval
+                        logger.warning(f"Monitoring cycle overran by {behind:.1f}s - skipping {missed} cycle(s)")
+                
+                time.sleep(max(0.0, next_run - time.monotonic()))
                 
         except KeyboardInterrupt:
             logger.info("Alert system stopping...")
         finally:
+            if metrics_server:
+                metrics_server.shutdown()
+            self.watermarks.save()
+            self.alert_state.save(force=True)
+            self._check_pool.shutdown(wait=True)
+            self.alert_writer.close()
+            self.metrics_writer.close()
             self.client.close()
 
 
@@ -307,8 +1443,16 @@ def main():
                         help='InfluxDB bucket to monitor')
     parser.add_argument('--alert-bucket', default=os.getenv('INFLUXDB_ALERT_BUCKET', 'alerts'),
                         help='InfluxDB bucket for alerts')
+    parser.add_argument('--rollup-bucket', default=os.getenv('INFLUXDB_ROLLUP_BUCKET', 'soil_data_rollups'),
+                        help='Bucket of rollup_service.py, used to seed known devices cheaply ("" to disable)')
+    parser.add_argument('--state-dir', default=os.getenv('ALERT_STATE_DIR', '.alert_state'),
+                        help='Directory for persistent alert system state (default: .alert_state)')
     parser.add_argument('--interval', type=int, default=30,
                         help='Check interval in seconds (default: 30)')
+    parser.add_argument('--overrun-policy', choices=['skip', 'catch-up'], default='skip',
+                        help='How to handle cycles that overrun the interval (default: skip)')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('ALERT_METRICS_PORT', '9108')),
+                        help='Port of the local Prometheus /metrics endpoint, 0 to disable (default: 9108)')
     parser.add_argument('--verbose', action='store_true',
                         help='Enable verbose logging')
     
@@ -325,11 +1469,13 @@ def main():
         token=args.token,
         org=args.org,
         bucket=args.bucket,
-        alert_bucket=args.alert_bucket
+        alert_bucket=args.alert_bucket,
+        state_dir=args.state_dir,
+        rollup_bucket=args.rollup_bucket or None
     )
     
     # Run monitoring
-    alert_system.run(interval=args.interval)
+    alert_system.run(interval=args.interval, overrun_policy=args.overrun_policy, metrics_port=args.metrics_port)
 
 
 if __name__ == '__main__':
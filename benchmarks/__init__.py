@@ -0,0 +1,4 @@
+"""
+Benchmark suite - local stand-ins for the MQTT broker and InfluxDB plus an
+end-to-end latency and scale runner (python -m benchmarks.run_benchmarks)
+"""
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Simulator driver for benchmarks
+Runs the soil sensor simulator's data model for many devices over a single
+MQTT connection, spreading publishes evenly over each interval and feeding
+valve commands back into the simulator (closed loop).
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+import soil_sensor_simulator as simulator
+
+logger = logging.getLogger(__name__)
+
+
+def device_ids(count):
+    """Return the benchmark device IDs"""
+    return [f"bench_sensor_{i:05d}" for i in range(count)]
+
+
+def main():
+    """Publish readings for --devices devices until --duration elapses"""
+    parser = argparse.ArgumentParser(description='Benchmark driver for the soil sensor simulator')
+    parser.add_argument('--broker', default='127.0.0.1', help='MQTT broker host')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--devices', type=int, default=100, help='Number of simulated devices')
+    parser.add_argument('--interval', type=float, default=10.0, help='Seconds between readings per device')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run')
+    parser.add_argument('--base-moisture', type=float, default=25.0,
+                        help='Starting moisture (below the controller and alert thresholds by default)')
+    parser.add_argument('--deadband', action='store_true',
+                        help='Publish only readings that pass the simulator\'s dead-band filter')
+    parser.add_argument('--heartbeat', type=float, default=240.0,
+                        help='Dead-band heartbeat in seconds')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    simulator.logger.setLevel(logging.WARNING)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="benchmark_simulator")
+    client.on_message = simulator.on_valve_message
+    client.max_inflight_messages_set(1000)
+    client.connect(args.broker, args.port, 60)
+    client.subscribe("farm/+/actuators/valve", qos=1)
+    client.loop_start()
+
+    deadband = simulator.DeadbandFilter(heartbeat_seconds=args.heartbeat) if args.deadband else None
+
+    devices = device_ids(args.devices)
+    topics = [f"farm/{device_id}/sensors" for device_id in devices]
+    spacing = args.interval / len(devices)
+
+    published = 0
+    started = time.monotonic()
+    deadline = started + args.duration
+    next_index = 0
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            # Publish every reading that is due, then sleep until the next one
+            due = int((now - started) / spacing) + 1
+            while next_index < due:
+                slot = next_index % len(devices)
+                record = simulator.generate_sensor_data(
+                    devices[slot], "Benchmark Field", base_moisture=args.base_moisture
+                )
+                next_index += 1
+                if deadband and not deadband.should_publish(
+                        record, simulator.valve_states.get(devices[slot], False)):
+                    continue
+                client.publish(topics[slot], record.encode(), qos=1)
+                published += 1
+
+            time.sleep(max(0.0, min(deadline, started + next_index * spacing) - time.monotonic()))
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    print(f"published={published} suppressed={deadband.suppressed if deadband else 0}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
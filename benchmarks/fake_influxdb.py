@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Fake InfluxDB v2 HTTP endpoint for benchmarks
+Accepts line protocol on /api/v2/write (optionally gzip-compressed) into an
+in-memory store and answers the Flux queries issued by the alert system
+(from/range/filter on _measurement and _field/last) with annotated CSV.
+Anything else in a Flux script is ignored.
+"""
+
+import bisect
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+_PRECISION_TO_NS = {'ns': 1, 'us': 1_000, 'ms': 1_000_000, 's': 1_000_000_000}
+_DURATION_UNITS = {'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def _split_unescaped(text, separator, quote_aware=False):
+    """Split on separator, honouring backslash escapes (and double quotes)"""
+    parts, start, i, in_quotes = [], 0, 0, False
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            i += 2
+            continue
+        if quote_aware and char == '"':
+            in_quotes = not in_quotes
+        elif char == separator and not in_quotes:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def _parse_field_value(raw):
+    if raw.startswith('"'):
+        return raw[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    if raw[-1] in 'iu' and raw[:-1].lstrip('-').isdigit():
+        return int(raw[:-1])
+    if raw in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+    if raw in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+    return float(raw)
+
+
+def parse_line_protocol(line, precision='ns', now_ns=None):
+    """
+    Parse one line of line protocol
+
+    Returns:
+        tuple: (measurement, {tag: value}, {field: value}, timestamp_ns)
+    """
+    sections = _split_unescaped(line, ' ', quote_aware=True)
+    key, fields_section = sections[0], sections[1]
+    timestamp = sections[2] if len(sections) > 2 and sections[2] else None
+
+    key_parts = _split_unescaped(key, ',')
+    measurement = _unescape(key_parts[0])
+    tags = {}
+    for part in key_parts[1:]:
+        tag_key, tag_value = _split_unescaped(part, '=')[:2]
+        tags[_unescape(tag_key)] = _unescape(tag_value)
+
+    fields = {}
+    for part in _split_unescaped(fields_section, ',', quote_aware=True):
+        field_key, _, raw = part.partition('=')
+        fields[_unescape(field_key)] = _parse_field_value(raw)
+
+    if timestamp is None:
+        timestamp_ns = now_ns if now_ns is not None else time.time_ns()
+    else:
+        timestamp_ns = int(timestamp) * _PRECISION_TO_NS[precision]
+    return measurement, tags, fields, timestamp_ns
+
+
+def _format_time(timestamp_ns):
+    seconds, nanos = divmod(timestamp_ns, 1_000_000_000)
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S') + f".{nanos:09d}Z"
+
+
+def _parse_time(text):
+    """Parse a Flux RFC3339 literal to epoch nanoseconds"""
+    match = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?Z', text)
+    base = datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    fraction = (match.group(2) or '').ljust(9, '0')[:9]
+    return int(base.timestamp()) * 1_000_000_000 + int(fraction)
+
+
+def _parse_duration_ns(text):
+    """Parse a Flux duration literal such as 5m or 604800s"""
+    total = 0.0
+    for amount, unit in re.findall(r'(\d+)(ns|us|ms|s|m|h|d|w)', text):
+        total += int(amount) * _DURATION_UNITS[unit]
+    return int(total * 1_000_000_000)
+
+
+class _Series:
+    __slots__ = ('tags', 'times', 'values')
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.times = []
+        self.values = []
+
+    def add(self, timestamp_ns, value):
+        if not self.times or timestamp_ns >= self.times[-1]:
+            self.times.append(timestamp_ns)
+            self.values.append(value)
+            return
+        idx = bisect.bisect_right(self.times, timestamp_ns)
+        self.times.insert(idx, timestamp_ns)
+        self.values.insert(idx, value)
+
+
+class InfluxStore:
+    """In-memory series store keyed by bucket, measurement, field and tag set"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}  # {(bucket, measurement, field, tags_tuple): _Series}
+        self.points_written = 0
+        self.queries = 0
+
+    def write(self, bucket, points):
+        """Store parsed (measurement, tags, fields, timestamp_ns) points"""
+        with self._lock:
+            for measurement, tags, fields, timestamp_ns in points:
+                tag_key = tuple(sorted(tags.items()))
+                for field, value in fields.items():
+                    key = (bucket, measurement, field, tag_key)
+                    series = self._series.get(key)
+                    if series is None:
+                        series = self._series[key] = _Series(dict(tags))
+                    series.add(timestamp_ns, value)
+                self.points_written += 1
+
+    def select(self, bucket, start_ns, stop_ns, measurements=None, fields=None, last=False):
+        """
+        Return matching series as (measurement, field, tags, [(time_ns, value)]) tuples
+        """
+        with self._lock:
+            self.queries += 1
+            tables = []
+            for (series_bucket, measurement, field, _), series in self._series.items():
+                if series_bucket != bucket:
+                    continue
+                if measurements and measurement not in measurements:
+                    continue
+                if fields and field not in fields:
+                    continue
+                lo = bisect.bisect_left(series.times, start_ns)
+                hi = bisect.bisect_left(series.times, stop_ns)
+                if lo >= hi:
+                    continue
+                if last:
+                    rows = [(series.times[hi - 1], series.values[hi - 1])]
+                else:
+                    rows = list(zip(series.times[lo:hi], series.values[lo:hi]))
+                tables.append((measurement, field, series.tags, rows))
+            return tables
+
+
+def _flux_datatype(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    return 'string'
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    text = str(value)
+    if any(char in text for char in ',"\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def run_flux(store, script, now_ns=None):
+    """Evaluate the supported subset of a Flux script and return annotated CSV"""
+    now_ns = now_ns if now_ns is not None else time.time_ns()
+
+    bucket = re.search(r'from\(\s*bucket:\s*"([^"]+)"', script).group(1)
+
+    start_ns, stop_ns = 0, now_ns + 1
+    range_match = re.search(r'range\(\s*start:\s*([^,)\s]+)(?:\s*,\s*stop:\s*([^,)\s]+))?', script)
+    if range_match:
+        start_ns = _resolve_time(range_match.group(1), now_ns)
+        if range_match.group(2):
+            stop_ns = _resolve_time(range_match.group(2), now_ns)
+
+    measurements = set(re.findall(r'r\._measurement\s*==\s*"([^"]+)"', script))
+    fields = set(re.findall(r'r\._field\s*==\s*"([^"]+)"', script))
+    last = bool(re.search(r'\|>\s*last\(\)', script))
+
+    tables = store.select(bucket, start_ns, stop_ns, measurements, fields, last=last)
+
+    start_text, stop_text = _format_time(start_ns), _format_time(stop_ns)
+    blocks = []
+    for table_id, (measurement, field, tags, rows) in enumerate(tables):
+        tag_names = sorted(tags)
+        columns = ['result', 'table', '_start', '_stop', '_time', '_value', '_field', '_measurement'] + tag_names
+        datatypes = ['string', 'long', 'dateTime:RFC3339', 'dateTime:RFC3339', 'dateTime:RFC3339',
+                     _flux_datatype(rows[0][1]), 'string', 'string'] + ['string'] * len(tag_names)
+        groups = ['false', 'false', 'true', 'true', 'false', 'false', 'true', 'true'] + ['true'] * len(tag_names)
+
+        lines = [
+            '#datatype,' + ','.join(datatypes),
+            '#group,' + ','.join(groups),
+            '#default,_result,' + ',' * (len(columns) - 2),
+            ',' + ','.join(columns),
+        ]
+        tag_values = ','.join(_csv_value(tags[name]) for name in tag_names)
+        for timestamp_ns, value in rows:
+            row = f",,{table_id},{start_text},{stop_text},{_format_time(timestamp_ns)},{_csv_value(value)},{field},{measurement}"
+            lines.append(row + (',' + tag_values if tag_names else ''))
+        blocks.append('\r\n'.join(lines) + '\r\n')
+
+    return '\r\n'.join(blocks) + '\r\n'
+
+
+def _resolve_time(literal, now_ns):
+    if literal.startswith('-'):
+        return now_ns - _parse_duration_ns(literal[1:])
+    if literal.startswith('now()'):
+        return now_ns
+    return _parse_time(literal)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_ref = None
+
+    def _body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def _reply(self, status, body=b'', content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ('/health', '/ping'):
+            self._reply(200, b'{"status":"pass"}', 'application/json')
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        fake = self.server_ref
+        try:
+            body = self._body()
+            if url.path == '/api/v2/write':
+                bucket = params['bucket'][0]
+                precision = params.get('precision', ['ns'])[0]
+                now_ns = time.time_ns()
+                points = [
+                    parse_line_protocol(line, precision, now_ns)
+                    for line in body.decode().split('\n') if line.strip()
+                ]
+                if fake.write_delay:
+                    time.sleep(fake.write_delay)
+                fake.store.write(bucket, points)
+                if fake.on_write:
+                    fake.on_write(bucket, points)
+                self._reply(204)
+            elif url.path == '/api/v2/query':
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    script = json.loads(body)['query']
+                else:
+                    script = body.decode()
+                csv = run_flux(fake.store, script).encode()
+                self._reply(200, csv, 'text/csv; charset=utf-8')
+            else:
+                self._reply(404)
+        except Exception as e:
+            logger.error(f"Fake InfluxDB failed on {url.path}: {e}")
+            self._reply(400, json.dumps({'code': 'invalid', 'message': str(e)}).encode(), 'application/json')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeInfluxDB:
+    """Fake InfluxDB v2 HTTP server running in a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, on_write=None, write_delay=0.0):
+        """
+        Args:
+            host: Interface to listen on
+            port: TCP port (0 picks a free one, see .port)
+            on_write: Optional callable(bucket, points) run after every write
+            write_delay: Artificial per-request write latency in seconds
+        """
+        self.store = InfluxStore()
+        self.on_write = on_write
+        self.write_delay = write_delay
+        handler = type('FakeInfluxHandler', (_Handler,), {'server_ref': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.host = host
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-influxdb", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
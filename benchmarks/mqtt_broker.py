@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Local MQTT broker stand-in for benchmarks
+A minimal in-process MQTT 3.1.1 broker: CONNECT, SUBSCRIBE/UNSUBSCRIBE with
++ and # wildcards, PUBLISH at QoS 0/1/2, PINGREQ and DISCONNECT. No
+authentication, retained messages or persistent sessions. An optional hook
+sees every published message, which the benchmark uses to time messages
+and to stand in for Telegraf.
+"""
+
+import asyncio
+import logging
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter, topic):
+    """Return True if topic matches an MQTT topic filter"""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def _encode_length(length):
+    """Encode an MQTT remaining length"""
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value):
+    data = value.encode()
+    return struct.pack('!H', len(data)) + data
+
+
+class _Session:
+    """One connected client"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = {}  # {topic_filter: qos}
+        self._packet_id = 0
+
+    def next_packet_id(self):
+        self._packet_id = self._packet_id % 65535 + 1
+        return self._packet_id
+
+    def send(self, packet_type, flags, body):
+        self.writer.write(bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body)
+
+
+class MQTTBroker:
+    """In-process MQTT broker running its own event loop thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, on_publish=None):
+        """
+        Args:
+            host: Interface to listen on
+            port: TCP port (0 picks a free one, see .port after start())
+            on_publish: Optional callable(topic, payload) run for every publish
+        """
+        self.host = host
+        self.port = port
+        self.on_publish = on_publish
+        self.sessions = set()
+        self.messages_routed = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        """Start listening in a background thread"""
+        self._thread = threading.Thread(target=self._run, name="mqtt-broker", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError("MQTT broker stand-in did not start")
+        return self
+
+    def stop(self):
+        """Close all connections and stop the event loop"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._shutdown)
+            self._thread.join(5)
+
+    def _shutdown(self):
+        # Abort on the loop so clients see the connection drop, like a broker outage
+        self._server.close()
+        for session in list(self.sessions):
+            session.writer.transport.abort()
+        self._loop.call_soon(self._loop.stop)
+
+    def has_subscriber(self, topic):
+        """Return True if any connected client is subscribed to topic"""
+        return any(
+            topic_matches(topic_filter, topic)
+            for session in list(self.sessions)
+            for topic_filter in list(session.subscriptions)
+        )
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle_client, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for session in list(self.sessions):
+                session.writer.close()
+            self._loop.close()
+
+    async def _read_packet(self, reader):
+        """Return (packet_type, flags, body) of the next packet"""
+        header = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await reader.readexactly(length) if length else b''
+        return header >> 4, header & 0x0F, body
+
+    async def _handle_client(self, reader, writer):
+        session = _Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+
+                if packet_type == CONNECT:
+                    self._handle_connect(session, body)
+                elif packet_type == PUBLISH:
+                    self._handle_publish(session, flags, body)
+                elif packet_type == PUBREL:
+                    session.send(PUBCOMP, 0, body[:2])
+                elif packet_type == SUBSCRIBE:
+                    self._handle_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._handle_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    session.send(PINGRESP, 0, b'')
+                elif packet_type == DISCONNECT:
+                    break
+                # PUBACK/PUBREC/PUBCOMP from subscribers need no bookkeeping here
+
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    def _handle_connect(self, session, body):
+        protocol_length = struct.unpack('!H', body[:2])[0]
+        offset = 2 + protocol_length + 4  # protocol name, level, flags, keepalive
+        client_id_length = struct.unpack('!H', body[offset:offset + 2])[0]
+        session.client_id = body[offset + 2:offset + 2 + client_id_length].decode()
+        session.send(CONNACK, 0, b'\x00\x00')
+        logger.debug(f"Client connected: {session.client_id}")
+
+    def _handle_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic_length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            session.send(PUBACK if qos == 1 else PUBREC, 0, packet_id)
+        payload = body[offset:]
+
+        if self.on_publish:
+            try:
+                self.on_publish(topic, payload)
+            except Exception as e:
+                logger.error(f"Publish hook failed for {topic}: {e}")
+
+        for target in list(self.sessions):
+            granted = None
+            for topic_filter, sub_qos in target.subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    granted = max(granted or 0, sub_qos)
+            if granted is None:
+                continue
+
+            out_qos = min(qos, granted, 1)
+            packet = _encode_string(topic)
+            if out_qos:
+                packet += struct.pack('!H', target.next_packet_id())
+            target.send(PUBLISH, out_qos << 1, packet + payload)
+            self.messages_routed += 1
+
+    def _handle_subscribe(self, session, body):
+        packet_id = body[:2]
+        offset = 2
+        granted = bytearray()
+        while offset < len(body):
+            length = struct.unpack('!H', body[offset:offset + 2])[0]
+            topic_filter = body[offset + 2:offset + 2 + length].decode()
+            qos = min(body[offset + 2 + length] & 0x03, 1)
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            offset += 3 + length
+        session.send(SUBACK, 0, packet_id + bytes(granted))
+
+    def _handle_unsubscribe(self, session, body):
+        packet_id = body[:2]
+        offset = 2
+        while offset < len(body):
+            length = struct.unpack('!H', body[offset:offset + 2])[0]
+            session.subscriptions.pop(body[offset + 2:offset + 2 + length].decode(), None)
+            offset += 2 + length
+        session.send(UNSUBACK, 0, packet_id)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency and scale benchmark
+Starts a local MQTT broker stand-in and a fake InfluxDB, then for each scale
+runs the irrigation controller and alert system against them while the
+simulator driver publishes readings for N devices. Reports sensor -> valve
+command latency, alert detection delay, and CPU/RSS per component.
+
+Usage:
+    python -m benchmarks.run_benchmarks --devices 100 1000 10000 --output benchmark_results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fake_influxdb import FakeInfluxDB
+from benchmarks.mqtt_broker import MQTTBroker, topic_matches
+from sensor_record import DEVICE_ID, MEASUREMENT, NUMERIC_FIELDS, SensorRecordError, decode
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENSOR_BUCKET = "soil_data"
+ALERT_BUCKET = "alerts"
+
+
+def percentiles(samples):
+    """Summarize samples (seconds) as milliseconds: count, mean, p50, p90, p99, max"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1000.0
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * 1000.0,
+        'p50': rank(50),
+        'p90': rank(90),
+        'p99': rank(99),
+        'max': ordered[-1] * 1000.0,
+    }
+
+
+class ProcessSampler:
+    """Samples CPU time and resident memory of a process from /proc"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_seconds = None
+        self.rss_peak_bytes = None
+        self.started = time.monotonic()
+        self.ended = None
+        self._stop = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            stat = f.read()
+        fields = stat[stat.rindex(')') + 2:].split()
+        self.cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss = int(f.read().split()[1]) * self._page_size
+        self.rss_peak_bytes = max(self.rss_peak_bytes or 0, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._sample()
+            except (OSError, ValueError, IndexError):
+                break  # Process exited or /proc is unavailable
+            self._stop.wait(self.interval)
+        self.ended = time.monotonic()
+
+    def summary(self):
+        if self.cpu_seconds is None:
+            return {'available': False}
+        wall = (self.ended or time.monotonic()) - self.started
+        return {
+            'cpu_seconds': round(self.cpu_seconds, 3),
+            'cpu_percent': round(self.cpu_seconds / wall * 100.0, 1) if wall > 0 else None,
+            'rss_peak_mb': round(self.rss_peak_bytes / (1024 * 1024), 1),
+        }
+
+
+class Recorder:
+    """Timestamps messages seen by the stand-ins and forwards readings like Telegraf"""
+
+    def __init__(self, store):
+        self.store = store
+        self.recording = True
+        self.readings = 0
+        self.ingest_errors = 0
+        self.valve_commands = 0
+        self.valve_latencies = []
+        self.alert_delays = []
+        self._lock = threading.Lock()
+        self._last_reading = {}   # {device_id: perf_counter of newest reading}
+        self._first_reading = {}  # {device_id: perf_counter of first reading}
+        self._alerted = set()
+
+    def on_publish(self, topic, payload):
+        """Broker hook: time readings and valve commands, ingest readings"""
+        now = time.perf_counter()
+        if topic_matches("farm/+/sensors", topic):
+            self._ingest(topic, payload)
+            device_id = topic.split('/')[1]
+            with self._lock:
+                self.readings += 1
+                self._last_reading[device_id] = now
+                self._first_reading.setdefault(device_id, now)
+        elif topic_matches("farm/+/actuators/valve", topic):
+            device_id = topic.split('/')[1]
+            with self._lock:
+                if not self.recording:
+                    return
+                self.valve_commands += 1
+                sent = self._last_reading.get(device_id)
+                if sent is not None:
+                    self.valve_latencies.append(now - sent)
+
+    def _ingest(self, topic, payload):
+        """Telegraf stand-in: write the reading straight into the fake InfluxDB"""
+        try:
+            record = decode(payload)
+        except SensorRecordError:
+            self.ingest_errors += 1
+            return
+        fields = {name: getattr(record, name) for name in NUMERIC_FIELDS if getattr(record, name) is not None}
+        timestamp = datetime.fromisoformat(record.timestamp.replace('Z', '+00:00'))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        point = (MEASUREMENT, {DEVICE_ID: record.device_id, 'topic': topic}, fields,
+                 int(timestamp.timestamp() * 1_000_000) * 1000)
+        self.store.write(SENSOR_BUCKET, [point])
+
+    def on_influx_write(self, bucket, points):
+        """Fake InfluxDB hook: time the first active alert per device"""
+        if bucket != ALERT_BUCKET:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            for measurement, tags, fields, _ in points:
+                if measurement != "alerts" or fields.get('active') is not True:
+                    continue
+                device_id = tags.get('device_id')
+                first = self._first_reading.get(device_id)
+                if first is None or device_id in self._alerted:
+                    continue
+                self._alerted.add(device_id)
+                self.alert_delays.append(now - first)
+
+
+def _start_component(name, args, log_dir):
+    log = open(os.path.join(log_dir, f"{name}.log"), 'w')
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    process = subprocess.Popen([sys.executable] + args, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT, env=env)
+    process.log_path = log.name
+    return process
+
+
+def _stop_component(process, timeout=15):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return process.returncode
+
+
+def _wait_until(condition, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+
+def run_scale(devices, args):
+    """Run one benchmark scale and return its result dict"""
+    logger.info(f"=== Benchmark: {devices} devices ===")
+    work_dir = tempfile.mkdtemp(prefix=f"soil_bench_{devices}_")
+
+    fake_influx = FakeInfluxDB(write_delay=args.influx_write_delay)
+    recorder = Recorder(fake_influx.store)
+    fake_influx.on_write = recorder.on_influx_write
+    fake_influx.start()
+    broker = MQTTBroker(on_publish=recorder.on_publish).start()
+
+    self_sampler = ProcessSampler(os.getpid()).start()
+    components = {}
+    samplers = {}
+    errors = []
+    try:
+        components['irrigation_controller'] = _start_component('irrigation_controller', [
+            'irrigation_controller.py',
+            '--broker', '127.0.0.1', '--port', str(broker.port),
+            '--influxdb-url', fake_influx.url, '--influxdb-token', 'benchmark',
+            '--influxdb-org', 'smartfarm', '--influxdb-bucket', SENSOR_BUCKET,
+        ], work_dir)
+        components['alert_system'] = _start_component('alert_system', [
+            'alert_system.py',
+            '--url', fake_influx.url, '--token', 'benchmark', '--org', 'smartfarm',
+            '--bucket', SENSOR_BUCKET, '--alert-bucket', ALERT_BUCKET,
+            '--interval', str(args.alert_interval), '--state-dir', os.path.join(work_dir, 'alert_state'),
+            '--metrics-port', '0',
+        ], work_dir)
+
+        _wait_until(lambda: broker.has_subscriber("farm/bench/sensors"), 30, "irrigation controller to subscribe")
+        _wait_until(lambda: fake_influx.store.queries > 0, 30, "alert system to start")
+
+        components['simulator'] = _start_component('simulator', [
+            '-m', 'benchmarks.drive_simulator',
+            '--broker', '127.0.0.1', '--port', str(broker.port),
+            '--devices', str(devices), '--interval', str(args.interval),
+            '--duration', str(args.duration),
+        ] + (['--deadband'] if args.deadband else []), work_dir)
+
+        for name, process in components.items():
+            samplers[name] = ProcessSampler(process.pid).start()
+
+        started = time.monotonic()
+        try:
+            components['simulator'].wait(args.duration + 120)
+        except subprocess.TimeoutExpired:
+            errors.append("simulator did not finish in time")
+        elapsed = time.monotonic() - started
+
+        # Let in-flight valve commands and the next alert cycles land
+        time.sleep(args.settle)
+        recorder.recording = False
+    finally:
+        for name, process in components.items():
+            returncode = _stop_component(process)
+            if returncode not in (0, -signal.SIGINT, None):
+                errors.append(f"{name} exited with {returncode} (log: {process.log_path})")
+        for sampler in samplers.values():
+            sampler.stop()
+        self_sampler.stop()
+        broker.stop()
+        fake_influx.stop()
+
+    component_stats = {name: sampler.summary() for name, sampler in samplers.items()}
+    component_stats['stand_ins'] = self_sampler.summary()
+
+    return {
+        'devices': devices,
+        'interval_s': args.interval,
+        'duration_s': round(elapsed, 2),
+        'readings_published': recorder.readings,
+        'readings_per_second': round(recorder.readings / elapsed, 1) if elapsed else None,
+        'ingest_errors': recorder.ingest_errors,
+        'valve_commands': recorder.valve_commands,
+        'sensor_to_valve_latency_ms': percentiles(recorder.valve_latencies),
+        'alert_detection_delay_ms': percentiles(recorder.alert_delays),
+        'devices_alerted': len(recorder.alert_delays),
+        'points_in_influxdb': fake_influx.store.points_written,
+        'components': component_stats,
+        'errors': errors,
+        'work_dir': work_dir,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(report, baseline=None):
+    """Print a compact table, with relative change against a baseline report"""
+    previous = {result['devices']: result for result in (baseline or {}).get('results', [])}
+
+    def change(current, old):
+        if current is None or not old:
+            return ''
+        return f" ({(current - old) / old * 100.0:+.0f}%)"
+
+    for result in report['results']:
+        old = previous.get(result['devices'], {})
+        print(f"\n{result['devices']} devices - {result['readings_per_second']} readings/s, "
+              f"{result['points_in_influxdb']} points stored{change(result['points_in_influxdb'], old.get('points_in_influxdb'))}, "
+              f"{result['valve_commands']} valve commands{change(result['valve_commands'], old.get('valve_commands'))}")
+        for key in ('sensor_to_valve_latency_ms', 'alert_detection_delay_ms'):
+            stats = result[key]
+            old_stats = old.get(key, {})
+            if not stats.get('count'):
+                print(f"  {key}: no samples")
+                continue
+            print(f"  {key}: p50={stats['p50']:.1f}{change(stats['p50'], old_stats.get('p50'))}"
+                  f" p99={stats['p99']:.1f}{change(stats['p99'], old_stats.get('p99'))}"
+                  f" max={stats['max']:.1f} (n={stats['count']})")
+        for name, stats in result['components'].items():
+            if not stats.get('available', True):
+                continue
+            old_stats = old.get('components', {}).get(name, {})
+            print(f"  {name}: cpu={stats['cpu_percent']}%{change(stats['cpu_percent'], old_stats.get('cpu_percent'))}"
+                  f" rss_peak={stats['rss_peak_mb']}MB{change(stats['rss_peak_mb'], old_stats.get('rss_peak_mb'))}")
+        for error in result['errors']:
+            print(f"  ERROR: {error}")
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description='End-to-end latency and scale benchmark')
+    parser.add_argument('--devices', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Device counts to benchmark (default: 100 1000 10000)')
+    parser.add_argument('--interval', type=float, default=10.0,
+                        help='Seconds between readings per device (default: 10)')
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help='Seconds to publish per scale (default: 30)')
+    parser.add_argument('--alert-interval', type=int, default=5,
+                        help='Alert system check interval in seconds (default: 5)')
+    parser.add_argument('--settle', type=float, default=10.0,
+                        help='Seconds to wait for late commands and alerts after publishing (default: 10)')
+    parser.add_argument('--influx-write-delay', type=float, default=0.0,
+                        help='Artificial fake InfluxDB write latency in seconds (default: 0)')
+    parser.add_argument('--deadband', action='store_true',
+                        help='Run the simulator in dead-band (report-by-exception) mode')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='Result file (default: benchmark_results.json)')
+    parser.add_argument('--baseline',
+                        help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/stat'):
+        logger.warning("/proc is not available - CPU and RSS will not be reported")
+
+    report = {
+        'benchmark': 'soilsimulator-iot end-to-end',
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'interval_s': args.interval,
+            'duration_s': args.duration,
+            'alert_interval_s': args.alert_interval,
+            'settle_s': args.settle,
+            'influx_write_delay_s': args.influx_write_delay,
+            'deadband': args.deadband,
+            'ingest': 'direct from broker stand-in (no Telegraf flush interval)',
+        },
+        'results': [run_scale(devices, args) for devices in args.devices],
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(report, baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
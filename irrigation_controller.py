@@ -14,6 +14,7 @@ from datetime import datetime, timezone
 import paho.mqtt.client as mqtt
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.write_api import SYNCHRONOUS
+from sensor_record import DEVICE_ID, SOIL_MOISTURE, SensorRecordError, decode
 
 # Configure logging
 logging.basicConfig(
@@ -36,6 +37,9 @@ class IrrigationController:
     MAX_IRRIGATION_DURATION = 600  # Maximum 10 minutes
     COOLDOWN_PERIOD = 900          # 15 minutes between irrigations
     
+    # Only these sensor record fields are decoded from incoming payloads
+    DECODE_FIELDS = (DEVICE_ID, SOIL_MOISTURE)
+    
     def __init__(self, mqtt_broker, mqtt_port, mqtt_username=None, mqtt_password=None,
                  influxdb_url=None, influxdb_token=None, influxdb_org=None, influxdb_bucket=None,
                  moisture_low=None, moisture_high=None):
@@ -101,9 +105,9 @@ class IrrigationController:
         """Callback when a message is received"""
         try:
             # Parse sensor data
-            payload = json.loads(msg.payload.decode())
-            device_id = payload.get('device_id', 'unknown')
-            moisture = payload.get('soil_moisture_percent')
+            record = decode(msg.payload, self.DECODE_FIELDS)
+            device_id = record.device_id or 'unknown'
+            moisture = record.soil_moisture_percent
             
             if moisture is None:
                 return
@@ -113,8 +117,8 @@ class IrrigationController:
             # Make irrigation decision
             self._make_irrigation_decision(device_id, moisture)
             
-        except json.JSONDecodeError:
-            logger.warning(f"Failed to parse JSON from topic {msg.topic}")
+        except SensorRecordError as e:
+            logger.warning(f"Invalid sensor payload on topic {msg.topic}: {e}")
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Rollup Service - Maintains downsampled sensor data for dashboards and long queries
+Incrementally aggregates raw mqtt_consumer readings into a separate bucket:
+  - soil_rollup_1m: per-device 1-minute min/max/sum/count/mean of every numeric field
+  - soil_rollup_1h: the same per hour, merged from the 1-minute aggregates
+Recent windows are re-aggregated every cycle to pick up late readings; older
+hours that received late readings are found by comparing raw and rollup counts.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from influxdb_client import InfluxDBClient, Point
+from influxdb_client.client.write_api import SYNCHRONOUS
+from sensor_record import DEVICE_ID, MEASUREMENT, NUMERIC_FIELDS, SOIL_MOISTURE
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Rollup measurements; timestamps are window starts
+MINUTE_MEASUREMENT = "soil_rollup_1m"
+HOUR_MEASUREMENT = "soil_rollup_1h"
+
+def rollup_field(field, stat):
+    """Return the field name of a statistic (min, max, sum, count, mean), e.g. soil_moisture_percent_mean"""
+    return f"{field}_{stat}"
+
+
+def _flux_time(ts):
+    """Format an aware datetime as a Flux RFC3339 time literal"""
+    return ts.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _floor(ts, seconds):
+    """Round an aware datetime down to a multiple of seconds since the epoch"""
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, timezone.utc)
+
+
+def _merge(stats, other):
+    """Merge (min, max, sum, count) aggregates"""
+    if stats is None:
+        return other
+    return (min(stats[0], other[0]), max(stats[1], other[1]), stats[2] + other[2], stats[3] + other[3])
+
+
+class RollupService:
+    """Incrementally maintain 1-minute and 1-hour rollups of sensor readings"""
+    
+    MINUTE = 60
+    HOUR = 3600
+    
+    # Minutes younger than this are left alone - Telegraf may still be flushing them
+    SETTLE_SECONDS = 30
+    
+    # Every cycle re-aggregates this much already rolled-up data to absorb late readings
+    LATE_DATA_GRACE_SECONDS = 600
+    
+    # Older late readings are found by comparing raw and rollup counts per hour
+    RECONCILE_INTERVAL_SECONDS = 900
+    RECONCILE_LOOKBACK_SECONDS = 48 * 3600  # 48 hours
+    
+    # How far back the first run (without a persisted watermark) starts
+    INITIAL_BACKFILL_SECONDS = 24 * 3600  # 24 hours
+    
+    WRITE_BATCH_SIZE = 5000
+    
+    def __init__(self, influxdb_url, token, org, bucket, rollup_bucket="soil_data_rollups", state_dir=None):
+        """Initialize rollup service"""
+        self.client = InfluxDBClient(url=influxdb_url, token=token, org=org)
+        self.query_api = self.client.query_api()
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.org = org
+        self.bucket = bucket
+        self.rollup_bucket = rollup_bucket
+        
+        # Persistent state (the minute watermark) lives in state_dir, if given
+        self.state_path = None
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            self.state_path = os.path.join(state_dir, 'rollup_state.json')
+        
+        # End of the last rolled-up minute; everything before it has rollups
+        self.watermark = None
+        self._load_state()
+        self._last_reconcile = None
+        
+        # 1-minute aggregates of recent hours, so hours can be re-merged without re-querying
+        self._minute_cache = {}  # {hour_start: {(device_id, field, minute_start): (min, max, sum, count)}}
+        
+        self.points_written = 0
+        
+        self._ensure_rollup_bucket()
+        logger.info(f"Rollup service initialized - {bucket} -> {rollup_bucket}")
+    
+    def _load_state(self):
+        """Load the persisted watermark, ignoring a missing or corrupt file"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        
+        try:
+            with open(self.state_path) as f:
+                raw = json.load(f)
+            self.watermark = datetime.fromisoformat(raw['watermark'])
+            logger.info(f"Resuming rollups from {self.watermark.isoformat()}")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable rollup state file {self.state_path}: {e}")
+    
+    def save_state(self):
+        """Atomically persist the watermark"""
+        if not self.state_path or self.watermark is None:
+            return
+        
+        try:
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'watermark': self.watermark.isoformat()}, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            logger.error(f"Error saving rollup state to {self.state_path}: {e}")
+    
+    def _ensure_rollup_bucket(self):
+        """Create the rollup bucket if it does not exist yet"""
+        try:
+            buckets_api = self.client.buckets_api()
+            if buckets_api.find_bucket_by_name(self.rollup_bucket) is None:
+                buckets_api.create_bucket(bucket_name=self.rollup_bucket, org=self.org)
+                logger.info(f"Created rollup bucket: {self.rollup_bucket}")
+        except Exception as e:
+            logger.warning(f"Could not verify rollup bucket {self.rollup_bucket}: {e}")
+    
+    def rewind(self, seconds):
+        """Move the watermark back so the given span is re-aggregated on the next cycle"""
+        floor = _floor(datetime.now(timezone.utc) - timedelta(seconds=seconds), self.HOUR)
+        if self.watermark is None or floor < self.watermark:
+            self.watermark = floor
+            logger.info(f"Re-processing rollups from {floor.isoformat()}")
+    
+    def _aggregate_minutes(self, start, stop):
+        """
+        Aggregate raw readings into 1-minute windows (server-side)
+        
+        Returns:
+            dict: {(device_id, field, minute_start): (min, max, sum, count)}
+        """
+        field_filter = ' or '.join(f'r._field == "{field}"' for field in NUMERIC_FIELDS)
+        aggregates = ''.join(
+            f'data |> aggregateWindow(every: 1m, fn: {fn}, timeSrc: "_start", createEmpty: false)'
+            f' |> yield(name: "{fn}")\n'
+            for fn in ("min", "max", "sum", "count")
+        )
+        query = f'''
+        data = from(bucket: "{self.bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")
+          |> filter(fn: (r) => {field_filter})
+        
+        {aggregates}'''
+        
+        # {(device_id, field, minute_start, series): [min, max, sum, count]}
+        partial = {}
+        position = {"min": 0, "max": 1, "sum": 2, "count": 3}
+        for table in self.query_api.query(query):
+            for record in table.records:
+                # Tags other than device_id (topic, host) split a device into several series
+                series = tuple(sorted(
+                    (key, value) for key, value in record.values.items()
+                    if not key.startswith('_') and key not in ('result', 'table')
+                ))
+                key = (record.values.get(DEVICE_ID) or 'unknown', record.get_field(), record.get_time(), series)
+                partial.setdefault(key, [None, None, 0.0, 0])[position[record.values['result']]] = record.get_value()
+        
+        minutes = {}
+        for (device_id, field, minute, _), (low, high, total, count) in partial.items():
+            if low is None or high is None or not count:
+                continue
+            key = (device_id, field, minute)
+            minutes[key] = _merge(minutes.get(key), (float(low), float(high), float(total), int(count)))
+        return minutes
+    
+    def _load_minutes(self, start, stop):
+        """Read back 1-minute rollups written by earlier cycles"""
+        query = f'''
+        from(bucket: "{self.rollup_bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r._measurement == "{MINUTE_MEASUREMENT}")
+          |> pivot(rowKey: ["_time", "{DEVICE_ID}"], columnKey: ["_field"], valueColumn: "_value")
+        '''
+        
+        minutes = {}
+        for table in self.query_api.query(query):
+            for record in table.records:
+                for field in NUMERIC_FIELDS:
+                    values = [record.values.get(rollup_field(field, stat)) for stat in ("min", "max", "sum", "count")]
+                    if None in values or not values[3]:
+                        continue
+                    minutes[(record.values.get(DEVICE_ID), field, record.get_time())] = (
+                        float(values[0]), float(values[1]), float(values[2]), int(values[3])
+                    )
+        return minutes
+    
+    def _points(self, measurement, aggregates):
+        """Build one point per device and window from {(device_id, field, window): stats}"""
+        rows = {}
+        for (device_id, field, window), stats in aggregates.items():
+            rows.setdefault((device_id, window), {})[field] = stats
+        
+        points = []
+        for (device_id, window), fields in rows.items():
+            point = Point(measurement).tag(DEVICE_ID, device_id).time(window)
+            for field, (low, high, total, count) in fields.items():
+                point.field(rollup_field(field, "min"), low)
+                point.field(rollup_field(field, "max"), high)
+                point.field(rollup_field(field, "sum"), total)
+                point.field(rollup_field(field, "count"), count)
+                point.field(rollup_field(field, "mean"), total / count)
+            points.append(point)
+        return points
+    
+    def _write(self, points):
+        """Write rollup points in batches (re-written windows overwrite older values)"""
+        for i in range(0, len(points), self.WRITE_BATCH_SIZE):
+            batch = points[i:i + self.WRITE_BATCH_SIZE]
+            self.write_api.write(bucket=self.rollup_bucket, org=self.org, record=batch)
+            self.points_written += len(batch)
+    
+    def _rollup_chunk(self, start, stop):
+        """Roll up [start, stop), which must lie within one hour"""
+        hour = _floor(start, self.HOUR)
+        minutes = self._aggregate_minutes(start, stop)
+        self._write(self._points(MINUTE_MEASUREMENT, minutes))
+        
+        # Windows re-aggregated without data lost their readings (e.g. deleted) - drop them
+        cached = self._minute_cache.get(hour)
+        if start == hour:
+            cached = self._minute_cache[hour] = {}
+        elif cached is None:
+            cached = self._minute_cache[hour] = self._load_minutes(hour, start)
+        for key in [key for key in cached if start <= key[2] < stop]:
+            del cached[key]
+        cached.update(minutes)
+        
+        hourly = {}
+        for (device_id, field, _), stats in cached.items():
+            key = (device_id, field, hour)
+            hourly[key] = _merge(hourly.get(key), stats)
+        self._write(self._points(HOUR_MEASUREMENT, hourly))
+        
+        return len(minutes)
+    
+    def rollup_range(self, start, stop):
+        """Roll up [start, stop) hour by hour; returns the number of minute aggregates"""
+        windows = 0
+        chunk_start = start
+        while chunk_start < stop:
+            chunk_stop = min(_floor(chunk_start, self.HOUR) + timedelta(seconds=self.HOUR), stop)
+            windows += self._rollup_chunk(chunk_start, chunk_stop)
+            chunk_start = chunk_stop
+        return windows
+    
+    def _hourly_counts(self, bucket, measurement, field, start, stop, fn):
+        """Return {(device_id, hour_start): count} from an hourly count query"""
+        query = f'''
+        from(bucket: "{bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r._measurement == "{measurement}")
+          |> filter(fn: (r) => r._field == "{field}")
+          |> aggregateWindow(every: 1h, fn: {fn}, timeSrc: "_start", createEmpty: false)
+        '''
+        counts = {}
+        for table in self.query_api.query(query):
+            for record in table.records:
+                key = (record.values.get(DEVICE_ID) or 'unknown', record.get_time())
+                counts[key] = counts.get(key, 0) + int(record.get_value())
+        return counts
+    
+    def find_late_hours(self, stop):
+        """
+        Return completed hours before stop whose raw data changed after being rolled up
+        
+        Raw moisture readings are counted per device and hour and compared with
+        the counts stored in the hourly rollup; hours with more raw readings
+        received late data.
+        """
+        start = _floor(datetime.now(timezone.utc) - timedelta(seconds=self.RECONCILE_LOOKBACK_SECONDS), self.HOUR)
+        stop = _floor(stop, self.HOUR)
+        if start >= stop:
+            return []
+        
+        raw = self._hourly_counts(self.bucket, MEASUREMENT, SOIL_MOISTURE, start, stop, "count")
+        rolled = self._hourly_counts(
+            self.rollup_bucket, HOUR_MEASUREMENT, rollup_field(SOIL_MOISTURE, "count"), start, stop, "sum"
+        )
+        late = {hour for (device_id, hour), count in raw.items() if count > rolled.get((device_id, hour), 0)}
+        return sorted(late)
+    
+    def run_rollup_cycle(self):
+        """Roll up newly completed minutes and re-process late data"""
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        stop = _floor(now - timedelta(seconds=self.SETTLE_SECONDS), self.MINUTE)
+        
+        if self.watermark is None:
+            self.watermark = _floor(now - timedelta(seconds=self.INITIAL_BACKFILL_SECONDS), self.HOUR)
+            logger.info(f"No rollup watermark - backfilling from {self.watermark.isoformat()}")
+        
+        # Older hours first, so the trailing re-aggregation below sees their final state
+        if (self._last_reconcile is None or
+                (now - self._last_reconcile).total_seconds() >= self.RECONCILE_INTERVAL_SECONDS):
+            self._last_reconcile = now
+            for hour in self.find_late_hours(self.watermark - timedelta(seconds=self.LATE_DATA_GRACE_SECONDS)):
+                logger.info(f"Late readings in {hour.isoformat()} - re-processing the hour")
+                self.rollup_range(hour, hour + timedelta(seconds=self.HOUR))
+        
+        start = min(self.watermark, stop) - timedelta(seconds=self.LATE_DATA_GRACE_SECONDS)
+        windows = self.rollup_range(start, stop)
+        self.watermark = max(self.watermark, stop)
+        self.save_state()
+        
+        # Only hours the trailing re-aggregation can still touch need their minutes cached
+        oldest = _floor(stop - timedelta(seconds=self.LATE_DATA_GRACE_SECONDS), self.HOUR)
+        for hour in [hour for hour in self._minute_cache if hour < oldest]:
+            del self._minute_cache[hour]
+        
+        logger.debug(f"Rolled up {windows} minute windows up to {stop.isoformat()} "
+                     f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+    
+    def run(self, interval=60):
+        """
+        Run rollups continuously on a fixed-rate schedule
+        
+        Args:
+            interval: Seconds between cycle starts
+        """
+        logger.info(f"Rollup service starting - interval: {interval}s, "
+                    f"late-data grace: {self.LATE_DATA_GRACE_SECONDS}s, "
+                    f"reconcile lookback: {self.RECONCILE_LOOKBACK_SECONDS // 3600}h")
+        
+        try:
+            next_run = time.monotonic()
+            while True:
+                try:
+                    self.run_rollup_cycle()
+                except Exception as e:
+                    logger.error(f"Rollup cycle failed: {e}")
+                
+                next_run += interval
+                behind = time.monotonic() - next_run
+                if behind > 0:
+                    # Windows are caught up by the next cycle's range anyway
+                    next_run += (int(behind // interval) + 1) * interval
+                    logger.warning(f"Rollup cycle overran by {behind:.1f}s")
+                
+                time.sleep(max(0.0, next_run - time.monotonic()))
+        
+        except KeyboardInterrupt:
+            logger.info("Rollup service stopping...")
+        finally:
+            self.save_state()
+            self.client.close()
+            logger.info(f"Rollup points written: {self.points_written}")
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description='Sensor data rollup service')
+    parser.add_argument('--url', default=os.getenv('INFLUXDB_URL', 'http://localhost:8086'),
+                        help='InfluxDB URL')
+    parser.add_argument('--token', default=os.getenv('INFLUXDB_TOKEN', 'your-super-secret-auth-token'),
+                        help='InfluxDB authentication token')
+    parser.add_argument('--org', default=os.getenv('INFLUXDB_ORG', 'smartfarm'),
+                        help='InfluxDB organization')
+    parser.add_argument('--bucket', default=os.getenv('INFLUXDB_BUCKET', 'soil_data'),
+                        help='InfluxDB bucket with raw sensor data')
+    parser.add_argument('--rollup-bucket', default=os.getenv('INFLUXDB_ROLLUP_BUCKET', 'soil_data_rollups'),
+                        help='InfluxDB bucket for rollups (default: soil_data_rollups)')
+    parser.add_argument('--state-dir', default=os.getenv('ROLLUP_STATE_DIR', '.rollup_state'),
+                        help='Directory for the persisted rollup watermark (default: .rollup_state)')
+    parser.add_argument('--interval', type=int, default=60,
+                        help='Rollup interval in seconds (default: 60)')
+    parser.add_argument('--reprocess-hours', type=float, default=0,
+                        help='Re-aggregate this many past hours on startup, e.g. after a large backfill')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Enable verbose logging')
+    
+    args = parser.parse_args()
+    
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    
+    logger.info("=== Rollup Service Starting ===")
+    
+    service = RollupService(
+        influxdb_url=args.url,
+        token=args.token,
+        org=args.org,
+        bucket=args.bucket,
+        rollup_bucket=args.rollup_bucket,
+        state_dir=args.state_dir
+    )
+    if args.reprocess_hours:
+        service.rewind(args.reprocess_hours * 3600)
+    
+    service.run(interval=args.interval)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Sensor Record - Shared wire format of soil sensor readings
+The single schema definition used by the simulator (encoding), the irrigation
+controller (decoding MQTT payloads) and the alert system (field names and
+value validation of InfluxDB records).
+"""
+
+import json
+import math
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Measurement name Telegraf's mqtt_consumer input writes sensor readings to
+MEASUREMENT = "mqtt_consumer"
+
+# Field names
+DEVICE_ID = "device_id"
+TIMESTAMP = "timestamp"
+FIELD_NAME = "field_name"
+SOIL_MOISTURE = "soil_moisture_percent"
+SOIL_TEMPERATURE = "soil_temperature_c"
+AIR_TEMPERATURE = "air_temperature_c"
+AIR_HUMIDITY = "air_humidity_percent"
+BATTERY_VOLTAGE = "battery_voltage"
+RAINFALL = "rainfall_mm"
+LOCATION = "location"
+
+# Wire schema: (field, type) in payload order
+SCHEMA = (
+    (DEVICE_ID, str),
+    (TIMESTAMP, str),
+    (FIELD_NAME, str),
+    (SOIL_MOISTURE, float),
+    (SOIL_TEMPERATURE, float),
+    (AIR_TEMPERATURE, float),
+    (AIR_HUMIDITY, float),
+    (BATTERY_VOLTAGE, float),
+    (RAINFALL, float),
+    (LOCATION, dict),
+)
+
+FIELDS = tuple(name for name, _ in SCHEMA)
+_FIELD_SET = frozenset(FIELDS)
+NUMERIC_FIELDS = tuple(name for name, field_type in SCHEMA if field_type is float)
+
+# Nested location keys, flattened to location_lat/location_lon like Telegraf's JSON parser does
+LOCATION_KEYS = ('lat', 'lon')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class SensorRecordError(ValueError):
+    """Raised when a payload does not match the sensor record schema"""
+
+
+class SensorRecord:
+    """One sensor reading; fields not present (or not decoded) are None"""
+
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        """Create a record from field values (unknown fields are rejected)"""
+        unknown = set(values) - set(FIELDS)
+        if unknown:
+            raise SensorRecordError(f"Unknown sensor record fields: {', '.join(sorted(unknown))}")
+        for name in FIELDS:
+            setattr(self, name, values.get(name))
+
+    def __getattr__(self, name):
+        # Only reached for slots never assigned, i.e. fields that were not decoded
+        if name in _FIELD_SET:
+            return None
+        raise AttributeError(f"'SensorRecord' object has no attribute {name!r}")
+
+    def to_dict(self):
+        """Return the wire representation, omitting unset fields"""
+        data = {}
+        for name in FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        return data
+
+    def encode(self):
+        """Serialize to the JSON wire format"""
+        return json.dumps(self.to_dict())
+
+    def __repr__(self):
+        return f"SensorRecord({self.to_dict()!r})"
+
+
+def _check_float(name, value):
+    # bool is an int subclass but never a valid reading
+    value_type = type(value)
+    if value_type is float:
+        if not math.isfinite(value):
+            raise SensorRecordError(f"{name} is not finite: {value!r}")
+        return value
+    if value_type is int:
+        return float(value)
+    raise SensorRecordError(f"{name} must be a number, got {value_type.__name__}")
+
+
+def _check_str(name, value):
+    if type(value) is not str:
+        raise SensorRecordError(f"{name} must be a string, got {type(value).__name__}")
+    return value
+
+
+def _check_location(name, value):
+    if type(value) is not dict:
+        raise SensorRecordError(f"{name} must be an object, got {type(value).__name__}")
+    return {key: _check_float(f"{name}.{key}", value[key]) for key in LOCATION_KEYS if key in value}
+
+
+_VALIDATORS = {str: _check_str, float: _check_float, dict: _check_location}
+_FIELD_VALIDATORS = {name: _VALIDATORS[field_type] for name, field_type in SCHEMA}
+
+# Values of exactly this type are already valid and skip the validator call
+_TRUSTED_TYPES = {name: field_type if field_type is str else type(None) for name, field_type in SCHEMA}
+
+
+@lru_cache(maxsize=32)
+def _decode_plan(fields):
+    """Return (name, validator, trusted type) triples for the requested fields"""
+    unknown = [name for name in fields if name not in _FIELD_VALIDATORS]
+    if unknown:
+        raise SensorRecordError(f"Unknown sensor record fields: {', '.join(unknown)}")
+    return tuple((name, _FIELD_VALIDATORS[name], _TRUSTED_TYPES[name]) for name in fields)
+
+
+def validate_value(name, value):
+    """Validate (and coerce) a single field value, e.g. one read back from InfluxDB"""
+    validator = _FIELD_VALIDATORS.get(name)
+    if validator is None:
+        raise SensorRecordError(f"Unknown sensor record field: {name}")
+    return validator(name, value)
+
+
+_new_record = object.__new__
+_json_decoder = json.JSONDecoder()
+
+
+def _parse_json(text):
+    """json.loads without its per-call overhead for the common well-formed payload"""
+    try:
+        value, end = _json_decoder.raw_decode(text)
+        if end == len(text):
+            return value
+    except ValueError:
+        pass
+    # Surrounding whitespace or invalid JSON: json.loads accepts it or raises the usual error
+    return json.loads(text)
+
+
+def decode(payload, fields=FIELDS):
+    """
+    Decode and validate a JSON payload
+
+    Args:
+        payload: JSON document as str or bytes
+        fields: Tuple of fields the consumer needs - all other fields are
+                neither validated nor copied and stay None on the record
+
+    Returns:
+        SensorRecord: Decoded record
+
+    Raises:
+        SensorRecordError: If the payload is not a JSON object or a requested
+                           field has the wrong type
+    """
+    try:
+        # Decoding first skips json's encoding detection on bytes; payloads are UTF-8
+        if type(payload) is not str:
+            payload = payload.decode()
+        raw = _parse_json(payload)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise SensorRecordError(f"Invalid JSON payload: {e}") from e
+
+    if type(raw) is not dict:
+        raise SensorRecordError(f"Payload must be a JSON object, got {type(raw).__name__}")
+
+    # Unset slots read as None (see SensorRecord.__getattr__), so only decoded fields are assigned
+    record = _new_record(SensorRecord)
+    for name, validator, trusted_type in _decode_plan(fields):
+        value = raw.get(name)
+        if value is not None:
+            if type(value) is not trusted_type:
+                value = validator(name, value)
+            setattr(record, name, value)
+
+    return record
+
+
+def _escape_tag(value):
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def timestamp_ns(timestamp):
+    """Convert a record timestamp (ISO 8601, trailing Z allowed) to epoch nanoseconds"""
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    delta = parsed - _EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds) * 1000
+
+
+def to_line_protocol(record, extra_tags=None):
+    """
+    Encode a record as one InfluxDB line protocol line
+
+    The layout matches what Telegraf's mqtt_consumer writes: measurement
+    mqtt_consumer, device_id (plus extra_tags, e.g. topic) as tags, and the
+    numeric fields with location flattened to location_lat/location_lon.
+    """
+    tags = {DEVICE_ID: record.device_id or 'unknown'}
+    if extra_tags:
+        tags.update(extra_tags)
+    key = MEASUREMENT + ''.join(
+        f",{_escape_tag(name)}={_escape_tag(str(value))}" for name, value in sorted(tags.items())
+    )
+
+    fields = []
+    for name in NUMERIC_FIELDS:
+        value = getattr(record, name)
+        if value is not None and math.isfinite(value):
+            fields.append(f"{name}={float(value)!r}")
+    if record.location:
+        for name in LOCATION_KEYS:
+            value = record.location.get(name)
+            if value is not None:
+                fields.append(f"{LOCATION}_{name}={float(value)!r}")
+    if not fields:
+        raise SensorRecordError(f"Record of {record.device_id} has no numeric fields")
+
+    line = f"{key} {','.join(fields)}"
+    if record.timestamp:
+        line += f" {timestamp_ns(record.timestamp)}"
+    return line
@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
 """
 Soil Sensor Simulator for Smart Agriculture IoT Project
-Simulates soil moisture and environmental sensors, publishes data to MQTT broker.
+Simulates soil moisture and environmental sensors, publishes data to MQTT broker
+and/or writes it straight to InfluxDB.
 """
 import paho.mqtt.client as mqtt
 import json
 import time
+import gzip
+import queue
 import random
 import logging
 import argparse
 import os
+import mmap
 import signal
+import struct
 import sys
+import threading
 from datetime import datetime
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from urllib.parse import urlencode, urlparse
+from sensor_record import SensorRecord, SensorRecordError, to_line_protocol
 
 # Configure logging
 logging.basicConfig(
@@ -24,9 +33,14 @@ logger = logging.getLogger(__name__)
 # Global flag for graceful shutdown
 running = True
 
-# Global state for irrigation valve (controlled by actuator)
-irrigation_valve_open = False
-current_moisture = 45.0  # Starting moisture level
+# Per-device state of irrigation valves (controlled by actuator), soil moisture and soil temperature
+DEFAULT_MOISTURE = 45.0  # Starting moisture level
+valve_states = {}        # {device_id: bool}
+moisture_levels = {}     # {device_id: float}
+soil_temperatures = {}   # {device_id: float}
+
+# Offline timeout of alert_system.py - dead-band heartbeats must arrive more often than this
+ALERT_SENSOR_TIMEOUT_SECONDS = 300
 
 def signal_handler(sig, frame):
     """Handle shutdown signals gracefully"""
@@ -36,17 +50,16 @@ def signal_handler(sig, frame):
 
 def on_valve_message(client, userdata, msg):
     """Callback when valve command is received"""
-    global irrigation_valve_open
     try:
         payload = json.loads(msg.payload.decode())
         action = payload.get('action', '').upper()
         device_id = payload.get('device_id', 'unknown')
         
         if action == 'OPEN':
-            irrigation_valve_open = True
+            valve_states[device_id] = True
             logger.info(f"🚰 Irrigation valve OPENED for {device_id} - moisture will increase faster")
         elif action == 'CLOSE':
-            irrigation_valve_open = False
+            valve_states[device_id] = False
             logger.info(f"🚫 Irrigation valve CLOSED for {device_id} - natural moisture decline")
         else:
             logger.debug(f"Unknown valve action: {action}")
@@ -62,11 +75,20 @@ def on_connect(client, userdata, flags, rc, properties=None):
         valve_topic = f"farm/{device_id}/actuators/valve"
         client.subscribe(valve_topic, qos=1)
         logger.info(f"📡 Subscribed to valve commands: {valve_topic}")
+        
+        # Start draining readings buffered while offline
+        forwarder = userdata.get('forwarder') if userdata else None
+        if forwarder:
+            forwarder.set_connected(True)
     else:
         logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
 
 def on_disconnect(client, userdata, flags, rc, properties=None):
     """Callback when client disconnects from broker"""
+    forwarder = userdata.get('forwarder') if userdata else None
+    if forwarder:
+        forwarder.set_connected(False)
+    
     if rc != 0:
         logger.warning(f"Unexpected disconnection from MQTT broker. Return code: {rc}")
         logger.info("Attempting to reconnect...")
@@ -75,7 +97,7 @@ def on_publish(client, userdata, mid, reason_code=None, properties=None):
     """Callback when message is published"""
     logger.debug(f"Message {mid} published successfully")
 
-def generate_sensor_data(device_id, field_name, base_moisture=45):
+def generate_sensor_data(device_id, field_name, base_moisture=DEFAULT_MOISTURE):
     """
     Generate realistic soil sensor data with closed-loop irrigation response
     
@@ -85,16 +107,13 @@ def generate_sensor_data(device_id, field_name, base_moisture=45):
         base_moisture: Base soil moisture level (default 45%)
     
     Returns:
-        dict: Sensor data payload
+        SensorRecord: Sensor data record
     """
-    global current_moisture, irrigation_valve_open
-    
-    # Initialize current_moisture if first run
-    if current_moisture == 45.0 and base_moisture != 45.0:
-        current_moisture = base_moisture
+    # Initialize moisture on the device's first reading
+    current_moisture = moisture_levels.get(device_id, base_moisture)
     
     # Realistic moisture dynamics based on irrigation state
-    if irrigation_valve_open:
+    if valve_states.get(device_id, False):
         # Valve is open: moisture increases significantly (irrigation effect)
         moisture_change = random.uniform(0.5, 2.0)  # +0.5% to +2.0% per reading
         current_moisture = min(100.0, current_moisture + moisture_change)
@@ -108,6 +127,14 @@ def generate_sensor_data(device_id, field_name, base_moisture=45):
     # Add small random variation for realism
     moisture_variation = random.uniform(-0.5, 0.5)
     current_moisture = max(0.0, min(100.0, current_moisture + moisture_variation))
+    moisture_levels[device_id] = current_moisture
+    
+    # Soil temperature drifts slowly within 18-28°C
+    soil_temperature = soil_temperatures.get(device_id)
+    if soil_temperature is None:
+        soil_temperature = random.uniform(18, 28)
+    soil_temperature = max(18.0, min(28.0, soil_temperature + random.uniform(-0.3, 0.3)))
+    soil_temperatures[device_id] = soil_temperature
     
     # Simulate rainfall detection (0-50 mm)
     # Higher chance of no rain, occasional moderate to heavy rain
@@ -119,19 +146,389 @@ def generate_sensor_data(device_id, field_name, base_moisture=45):
     else:
         rainfall_mm = round(random.uniform(5.0, 25.0), 1)  # Moderate to heavy rain
     
-    data = {
-        "device_id": device_id,
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "field_name": field_name,
-        "soil_moisture_percent": round(current_moisture, 2),
-        "soil_temperature_c": round(random.uniform(18, 28), 1),
-        "air_temperature_c": round(random.uniform(20, 32), 1),
-        "air_humidity_percent": round(random.uniform(40, 70), 1),
-        "battery_voltage": round(random.uniform(3.6, 4.2), 2),
-        "rainfall_mm": rainfall_mm,
-        "location": {"lat": 52.5200, "lon": 13.4050}  # Berlin coordinates
-    }
-    return data
+    return SensorRecord(
+        device_id=device_id,
+        timestamp=datetime.utcnow().isoformat() + "Z",
+        field_name=field_name,
+        soil_moisture_percent=round(current_moisture, 2),
+        soil_temperature_c=round(soil_temperature, 1),
+        air_temperature_c=round(random.uniform(20, 32), 1),
+        air_humidity_percent=round(random.uniform(40, 70), 1),
+        battery_voltage=round(random.uniform(3.6, 4.2), 2),
+        rainfall_mm=rainfall_mm,
+        location={"lat": 52.5200, "lon": 13.4050}  # Berlin coordinates
+    )
+
+class DeadbandFilter:
+    """
+    Report-by-exception: decides which readings a device actually sends
+    
+    A reading is published when soil moisture or soil temperature moved more
+    than its dead-band since the device's last published reading, when the
+    valve state changed, or when the heartbeat interval has elapsed. All
+    other readings are suppressed (and counted).
+    """
+    
+    REASONS = ('first', 'valve', 'moisture', 'temperature', 'heartbeat')
+    
+    def __init__(self, moisture_delta=1.0, temperature_delta=0.5, heartbeat_seconds=240.0):
+        """Initialize dead-bands (in % and °C) and the maximum silence per device"""
+        self.moisture_delta = moisture_delta
+        self.temperature_delta = temperature_delta
+        self.heartbeat_seconds = heartbeat_seconds
+        self.suppressed = 0
+        self.published = {reason: 0 for reason in self.REASONS}
+        self._last = {}  # {device_id: (moisture, temperature, valve_open, published_at)}
+    
+    def should_publish(self, record, valve_open, now=None):
+        """Return the reason to publish record, or None if it is suppressed"""
+        now = time.monotonic() if now is None else now
+        last = self._last.get(record.device_id)
+        
+        if last is None:
+            reason = 'first'
+        elif valve_open != last[2]:
+            reason = 'valve'
+        elif abs(record.soil_moisture_percent - last[0]) > self.moisture_delta:
+            reason = 'moisture'
+        elif abs(record.soil_temperature_c - last[1]) > self.temperature_delta:
+            reason = 'temperature'
+        elif now - last[3] >= self.heartbeat_seconds:
+            reason = 'heartbeat'
+        else:
+            self.suppressed += 1
+            return None
+        
+        self._last[record.device_id] = (record.soil_moisture_percent, record.soil_temperature_c, valve_open, now)
+        self.published[reason] += 1
+        return reason
+    
+    def summary(self):
+        """Return a one-line summary of published and suppressed readings"""
+        published = sum(self.published.values())
+        total = published + self.suppressed
+        share = self.suppressed / total * 100.0 if total else 0.0
+        reasons = ', '.join(f"{reason} {count}" for reason, count in self.published.items())
+        return f"{published} of {total} readings published, {self.suppressed} suppressed ({share:.1f}%) - {reasons}"
+
+
+class DiskRingBuffer:
+    """
+    Fixed-capacity FIFO of (topic, payload) messages in a memory-mapped file
+    
+    The file holds a header and `capacity` fixed-size slots, so its size never
+    changes. When the buffer is full the oldest message is overwritten and
+    counted as dropped. Buffered messages survive a restart.
+    """
+    
+    MAGIC = b'SSRB'
+    HEADER = struct.Struct('<4sIIQQQ')  # magic, slot size, capacity, first seq, next seq, dropped
+    LENGTHS = struct.Struct('<HH')      # topic length, payload length
+    
+    def __init__(self, path, capacity, slot_size=512):
+        """Open (or create) the buffer file at path"""
+        self.path = path
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = self.HEADER.size + capacity * slot_size
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self._file.fileno()).st_size != size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        
+        magic, stored_slot_size, stored_capacity, self._first, self._next, self.dropped = \
+            self.HEADER.unpack_from(self._mmap, 0)
+        if (magic, stored_slot_size, stored_capacity) != (self.MAGIC, slot_size, capacity):
+            if magic == self.MAGIC:
+                logger.warning(f"Buffer {path} has a different layout - discarding its contents")
+            self._first = self._next = self.dropped = 0
+            self._write_header()
+        elif len(self):
+            logger.info(f"Restored {len(self)} buffered messages from {path}")
+    
+    def __len__(self):
+        return self._next - self._first
+    
+    def _write_header(self):
+        self.HEADER.pack_into(self._mmap, 0, self.MAGIC, self.slot_size, self.capacity,
+                              self._first, self._next, self.dropped)
+    
+    def _offset(self, seq):
+        return self.HEADER.size + (seq % self.capacity) * self.slot_size
+    
+    def append(self, topic, payload):
+        """Append a message; returns False if it does not fit in a slot"""
+        topic = topic.encode()
+        payload = payload.encode() if isinstance(payload, str) else payload
+        if self.LENGTHS.size + len(topic) + len(payload) > self.slot_size:
+            return False
+        
+        with self._lock:
+            if len(self) >= self.capacity:
+                self._first += 1
+                self.dropped += 1
+            offset = self._offset(self._next)
+            self.LENGTHS.pack_into(self._mmap, offset, len(topic), len(payload))
+            offset += self.LENGTHS.size
+            self._mmap[offset:offset + len(topic)] = topic
+            offset += len(topic)
+            self._mmap[offset:offset + len(payload)] = payload
+            # Publish the slot only after its contents are in place
+            self._next += 1
+            self._write_header()
+        return True
+    
+    def peek(self, count):
+        """
+        Return up to count of the oldest messages
+        
+        Returns:
+            tuple: (end sequence number for pop(), [(topic, payload)])
+        """
+        messages = []
+        with self._lock:
+            end = min(self._first + count, self._next)
+            for seq in range(self._first, end):
+                offset = self._offset(seq)
+                topic_length, payload_length = self.LENGTHS.unpack_from(self._mmap, offset)
+                offset += self.LENGTHS.size
+                topic = self._mmap[offset:offset + topic_length].decode()
+                offset += topic_length
+                messages.append((topic, self._mmap[offset:offset + payload_length]))
+        return end, messages
+    
+    def pop(self, end):
+        """Remove the messages before sequence number end (as returned by peek)"""
+        with self._lock:
+            # Messages overwritten since the peek are already gone
+            self._first = max(self._first, min(end, self._next))
+            self._write_header()
+    
+    def close(self):
+        """Flush the buffer to disk and unmap it"""
+        with self._lock:
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.close()
+
+
+class StoreAndForward:
+    """
+    Publishes readings while connected and buffers them on disk while not
+    
+    After a reconnect a background thread drains the buffer in batches,
+    rate-limited so the backlog does not flood the broker and Telegraf.
+    A batch is removed from the buffer only after the broker acknowledged
+    it. While a backlog remains, new readings queue behind it to keep order.
+    """
+    
+    def __init__(self, client, buffer, qos=1, drain_rate=200.0, drain_batch=100, ack_timeout=10.0):
+        """Start the drain thread"""
+        self.client = client
+        self.buffer = buffer
+        self.qos = qos
+        self.drain_rate = drain_rate
+        self.drain_batch = drain_batch
+        self.ack_timeout = ack_timeout
+        
+        self.published = 0
+        self.buffered = 0
+        self.drained = 0
+        
+        self._connected = threading.Event()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run_drain, name="buffer-drain", daemon=True)
+        self._thread.start()
+    
+    def set_connected(self, connected):
+        """Track broker connection state (called from on_connect/on_disconnect)"""
+        if connected:
+            self._connected.set()
+            self._wake.set()
+        else:
+            self._connected.clear()
+    
+    def publish(self, topic, payload):
+        """Publish a reading, or buffer it; returns True if it went out directly"""
+        if self._connected.is_set() and not len(self.buffer):
+            result = self.client.publish(topic, payload, qos=self.qos)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.published += 1
+                return True
+        
+        was_full = len(self.buffer) >= self.buffer.capacity
+        if not self.buffer.append(topic, payload):
+            logger.error(f"Reading for {topic} is too large for the offline buffer - dropped")
+            return False
+        self.buffered += 1
+        if not was_full and len(self.buffer) >= self.buffer.capacity:
+            logger.warning(f"Offline buffer full ({self.buffer.capacity} readings) - overwriting the oldest")
+        if self._connected.is_set():
+            self._wake.set()
+        return False
+    
+    def close(self, timeout=5.0):
+        """Stop draining and close the buffer (undrained readings stay on disk)"""
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
+        self.buffer.close()
+    
+    def _run_drain(self):
+        """Drain the buffer whenever connected"""
+        while not self._stopping:
+            self._wake.wait(1.0)
+            self._wake.clear()
+            if not self._connected.is_set() or not len(self.buffer):
+                continue
+            
+            backlog = len(self.buffer)
+            logger.info(f"Draining {backlog} buffered readings at up to {self.drain_rate:.0f}/s")
+            while not self._stopping and self._connected.is_set() and len(self.buffer):
+                started = time.monotonic()
+                end, batch = self.buffer.peek(self.drain_batch)
+                if not self._publish_batch(batch):
+                    # Unacknowledged messages stay buffered and are resent (InfluxDB overwrites duplicates)
+                    logger.warning("Buffer drain interrupted - will resume after reconnect")
+                    break
+                self.buffer.pop(end)
+                self.drained += len(batch)
+                time.sleep(max(0.0, len(batch) / self.drain_rate - (time.monotonic() - started)))
+            
+            if not len(self.buffer):
+                logger.info(f"Offline buffer drained ({self.drained} readings forwarded so far)")
+    
+    def _publish_batch(self, batch):
+        """Publish a batch and wait until the broker acknowledged all of it"""
+        infos = [self.client.publish(topic, payload, qos=self.qos) for topic, payload in batch]
+        deadline = time.monotonic() + self.ack_timeout
+        for info in infos:
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+            except (ValueError, RuntimeError):
+                return False
+            if not info.is_published():
+                return False
+        return True
+
+
+class InfluxLineProtocolSink:
+    """
+    Writes readings straight to the InfluxDB v2 write API, bypassing MQTT and Telegraf
+    
+    Readings are queued as line protocol and sent in gzip-compressed batches by
+    a fixed number of worker threads, each reusing one keep-alive connection.
+    """
+    
+    def __init__(self, url, token, org, bucket, batch_size=5000, concurrency=2,
+                 flush_interval=1.0, timeout=10.0):
+        """Initialize the sink and start its writer threads"""
+        parsed = urlparse(url)
+        self._connection_class = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._timeout = timeout
+        self._path = parsed.path.rstrip('/') + '/api/v2/write?' + urlencode(
+            {'org': org, 'bucket': bucket, 'precision': 'ns'}
+        )
+        self._headers = {
+            'Authorization': f'Token {token}',
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Content-Encoding': 'gzip',
+        }
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        
+        self.points_written = 0
+        self.points_failed = 0
+        self.batches_written = 0
+        self._stats_lock = threading.Lock()
+        
+        # Bounded so a slow database applies backpressure instead of growing memory
+        self._queue = queue.Queue(maxsize=batch_size * concurrency * 2)
+        self._workers = [
+            threading.Thread(target=self._run_worker, name=f"influx-writer-{i}", daemon=True)
+            for i in range(concurrency)
+        ]
+        for worker in self._workers:
+            worker.start()
+    
+    def write(self, record, topic=None):
+        """Queue a SensorRecord for writing (blocks only when the queue is full)"""
+        self._queue.put(to_line_protocol(record, {'topic': topic} if topic else None))
+    
+    def close(self, timeout=30.0):
+        """Flush queued readings and stop the writer threads"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        logger.info(f"InfluxDB sink: {self.points_written} points in {self.batches_written} batches, "
+                    f"{self.points_failed} failed")
+    
+    def _run_worker(self):
+        """Collect batches from the queue and post them over one persistent connection"""
+        connection = None
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                line = self._queue.get(timeout=self.flush_interval)
+                if line is None:
+                    stopping = True
+                else:
+                    batch.append(line)
+                while not stopping and len(batch) < self.batch_size:
+                    line = self._queue.get_nowait()
+                    if line is None:
+                        stopping = True
+                    else:
+                        batch.append(line)
+            except queue.Empty:
+                pass
+            
+            if batch:
+                connection = self._post(connection, batch)
+        
+        if connection:
+            connection.close()
+    
+    def _post(self, connection, lines):
+        """Send one batch, reconnecting once on a broken keep-alive connection"""
+        body = gzip.compress('\n'.join(lines).encode(), compresslevel=5)
+        for attempt in (1, 2):
+            try:
+                if connection is None:
+                    connection = self._connection_class(self._host, self._port, timeout=self._timeout)
+                connection.request('POST', self._path, body=body, headers=self._headers)
+                response = connection.getresponse()
+                detail = response.read()
+                
+                with self._stats_lock:
+                    if 200 <= response.status < 300:
+                        self.points_written += len(lines)
+                        self.batches_written += 1
+                    else:
+                        self.points_failed += len(lines)
+                if response.status >= 300:
+                    logger.error(f"InfluxDB rejected batch of {len(lines)} points: "
+                                 f"HTTP {response.status} {detail[:200]!r}")
+                return connection
+            except (OSError, HTTPException) as e:
+                if connection:
+                    connection.close()
+                connection = None
+                if attempt == 2:
+                    with self._stats_lock:
+                        self.points_failed += len(lines)
+                    logger.error(f"Failed to write batch of {len(lines)} points to InfluxDB: {e}")
+        return connection
 
 def main():
     """Main function to run the sensor simulator"""
@@ -148,12 +545,15 @@ def main():
     parser.add_argument('--topic', type=str,
                        default=os.getenv('MQTT_TOPIC', 'farm/field_01/sensors'),
                        help='MQTT topic to publish to (default: farm/field_01/sensors, env: MQTT_TOPIC)')
-    parser.add_argument('--interval', type=int,
-                       default=int(os.getenv('PUBLISH_INTERVAL', '120')),
+    parser.add_argument('--interval', type=float,
+                       default=float(os.getenv('PUBLISH_INTERVAL', '120')),
                        help='Publish interval in seconds (default: 120, env: PUBLISH_INTERVAL)')
     parser.add_argument('--device-id', type=str,
                        default=os.getenv('DEVICE_ID', 'field_sensor_01'),
                        help='Device ID (default: field_sensor_01, env: DEVICE_ID)')
+    parser.add_argument('--num-devices', type=int,
+                       default=int(os.getenv('NUM_DEVICES', '1')),
+                       help='Number of simulated devices; more than one publishes to farm/<device_id>_<n>/sensors (default: 1, env: NUM_DEVICES)')
     parser.add_argument('--field-name', type=str,
                        default=os.getenv('FIELD_NAME', 'Field A - Tomatoes'),
                        help='Field name (default: Field A - Tomatoes, env: FIELD_NAME)')
@@ -163,6 +563,43 @@ def main():
     parser.add_argument('--password', type=str,
                        default=os.getenv('MQTT_PASSWORD'),
                        help='MQTT password for authentication (optional, env: MQTT_PASSWORD)')
+    parser.add_argument('--output', choices=['mqtt', 'influxdb', 'both'],
+                       default=os.getenv('SIMULATOR_OUTPUT', 'mqtt'),
+                       help='Where readings go: MQTT, straight to InfluxDB, or both (default: mqtt, env: SIMULATOR_OUTPUT)')
+    parser.add_argument('--influxdb-url', type=str,
+                       default=os.getenv('INFLUXDB_URL', 'http://localhost:8086'),
+                       help='InfluxDB URL for --output influxdb/both (env: INFLUXDB_URL)')
+    parser.add_argument('--influxdb-token', type=str,
+                       default=os.getenv('INFLUXDB_TOKEN', 'your-super-secret-auth-token'),
+                       help='InfluxDB token (env: INFLUXDB_TOKEN)')
+    parser.add_argument('--influxdb-org', type=str,
+                       default=os.getenv('INFLUXDB_ORG', 'smartfarm'),
+                       help='InfluxDB organization (default: smartfarm, env: INFLUXDB_ORG)')
+    parser.add_argument('--influxdb-bucket', type=str,
+                       default=os.getenv('INFLUXDB_BUCKET', 'soil_data'),
+                       help='InfluxDB bucket (default: soil_data, env: INFLUXDB_BUCKET)')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                       help='Readings per InfluxDB write request (default: 5000)')
+    parser.add_argument('--write-concurrency', type=int, default=2,
+                       help='Concurrent InfluxDB write connections (default: 2)')
+    parser.add_argument('--deadband', action='store_true',
+                       default=os.getenv('SIMULATOR_DEADBAND', '').lower() in ('1', 'true', 'yes'),
+                       help='Publish only on meaningful change, valve change or heartbeat (env: SIMULATOR_DEADBAND)')
+    parser.add_argument('--moisture-deadband', type=float, default=1.0,
+                       help='Soil moisture change in %% that triggers a publish in dead-band mode (default: 1.0)')
+    parser.add_argument('--temperature-deadband', type=float, default=0.5,
+                       help='Soil temperature change in °C that triggers a publish in dead-band mode (default: 0.5)')
+    parser.add_argument('--heartbeat', type=float, default=240.0,
+                       help=f'Maximum seconds between published readings in dead-band mode '
+                            f'(default: 240, must stay below the {ALERT_SENSOR_TIMEOUT_SECONDS}s offline timeout)')
+    parser.add_argument('--buffer-path', type=str,
+                       default=os.getenv('SIMULATOR_BUFFER_PATH', '.simulator_buffer/readings.buf'),
+                       help='Memory-mapped file buffering readings while the broker is unreachable (env: SIMULATOR_BUFFER_PATH)')
+    parser.add_argument('--buffer-size', type=int,
+                       default=int(os.getenv('SIMULATOR_BUFFER_SIZE', '20000')),
+                       help='Offline buffer capacity in readings, 0 to disable (default: 20000, env: SIMULATOR_BUFFER_SIZE)')
+    parser.add_argument('--drain-rate', type=float, default=200.0,
+                       help='Buffered readings published per second after a reconnect (default: 200)')
     parser.add_argument('--dry-run', action='store_true',
                        help='Dry run mode - print data without publishing to MQTT')
     parser.add_argument('--verbose', '-v', action='store_true',
@@ -178,19 +615,55 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
+    # (device_id, topic) per simulated device
+    if args.num_devices > 1:
+        device_ids = [f"{args.device_id}_{i:04d}" for i in range(args.num_devices)]
+        devices = [(device_id, f"farm/{device_id}/sensors") for device_id in device_ids]
+    else:
+        devices = [(args.device_id, args.topic)]
+    use_mqtt = args.output in ('mqtt', 'both')
+    use_influxdb = args.output in ('influxdb', 'both')
+    
     logger.info("=== Soil Sensor Simulator Starting ===")
-    logger.info(f"MQTT Broker: {args.broker}:{args.port}")
-    logger.info(f"MQTT Topic: {args.topic}")
-    logger.info(f"Device ID: {args.device_id}")
+    logger.info(f"Output: {args.output}")
+    if use_mqtt:
+        logger.info(f"MQTT Broker: {args.broker}:{args.port}")
+        logger.info(f"MQTT Topic: {devices[0][1]}" + (f" (+{len(devices) - 1} more)" if len(devices) > 1 else ""))
+    if use_influxdb:
+        logger.info(f"InfluxDB: {args.influxdb_url} bucket {args.influxdb_bucket} "
+                    f"(batch size {args.batch_size}, concurrency {args.write_concurrency})")
+    logger.info(f"Device ID: {args.device_id}" + (f" x {len(devices)}" if len(devices) > 1 else ""))
     logger.info(f"Field Name: {args.field_name}")
     logger.info(f"Publish Interval: {args.interval} seconds")
     logger.info(f"Dry Run Mode: {args.dry_run}")
     
     client = None
+    forwarder = None
+    influx_sink = None
+    deadband = None
+    
+    if args.deadband:
+        deadband = DeadbandFilter(args.moisture_deadband, args.temperature_deadband, args.heartbeat)
+        # Readings are only taken every interval, so the longest silence rounds up to a multiple of it
+        longest_silence = -(-args.heartbeat // args.interval) * args.interval
+        logger.info(f"Dead-band mode: ±{args.moisture_deadband}% moisture, ±{args.temperature_deadband}°C "
+                    f"soil temperature, heartbeat every {args.heartbeat:.0f}s")
+        if longest_silence >= ALERT_SENSOR_TIMEOUT_SECONDS:
+            logger.warning(f"Devices may stay silent for {longest_silence:.0f}s - the alert system "
+                           f"reports them offline after {ALERT_SENSOR_TIMEOUT_SECONDS}s")
+    
+    if not args.dry_run and use_influxdb:
+        influx_sink = InfluxLineProtocolSink(
+            args.influxdb_url, args.influxdb_token, args.influxdb_org, args.influxdb_bucket,
+            batch_size=args.batch_size, concurrency=args.write_concurrency
+        )
     
-    if not args.dry_run:
+    if not args.dry_run and use_mqtt:
         # Create MQTT client with callback API version 2
-        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, userdata={'device_id': args.device_id})
+        # With several devices, '+' subscribes to the valve topics of all of them
+        valve_device = args.device_id if len(devices) == 1 else '+'
+        userdata = {'device_id': valve_device}
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, userdata=userdata)
         client.on_connect = on_connect
         client.on_disconnect = on_disconnect
         client.on_publish = on_publish
@@ -204,9 +677,22 @@ def main():
         # Enable automatic reconnection
         client.reconnect_delay_set(min_delay=1, max_delay=120)
         
+        if args.buffer_size > 0:
+            # Readings go to disk while offline instead of paho's unbounded in-memory queue
+            client.max_queued_messages_set(1000)
+            forwarder = StoreAndForward(
+                client, DiskRingBuffer(args.buffer_path, args.buffer_size), drain_rate=args.drain_rate
+            )
+            userdata['forwarder'] = forwarder
+            logger.info(f"Offline buffer: {args.buffer_path} ({args.buffer_size} readings)")
+        
         try:
             logger.info(f"Connecting to MQTT broker at {args.broker}:{args.port}...")
-            client.connect(args.broker, args.port, 60)
+            if forwarder:
+                # Readings are buffered until the background loop gets through
+                client.connect_async(args.broker, args.port, 60)
+            else:
+                client.connect(args.broker, args.port, 60)
             client.loop_start()  # Start network loop in background thread
             time.sleep(2)  # Give time for connection to establish
         except Exception as e:
@@ -216,25 +702,48 @@ def main():
     
     try:
         message_count = 0
+        # Per-message logging only makes sense for a single device
+        log_message = logger.info if len(devices) == 1 else logger.debug
         while running:
-            # Generate sensor data
-            sensor_data = generate_sensor_data(
-                device_id=args.device_id,
-                field_name=args.field_name
-            )
-            payload = json.dumps(sensor_data)
-            
-            if args.dry_run:
-                # Dry run - just print the data
-                print(f"[DRY RUN] Would publish to {args.topic}: {payload}")
-            else:
-                # Publish to MQTT broker
-                result = client.publish(args.topic, payload, qos=1)
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    message_count += 1
-                    logger.info(f"Published message #{message_count}: {payload}")
-                else:
-                    logger.error(f"Failed to publish message. Error code: {result.rc}")
+            for device_id, topic in devices:
+                # Generate sensor data
+                sensor_data = generate_sensor_data(
+                    device_id=device_id,
+                    field_name=args.field_name
+                )
+                
+                if deadband and not deadband.should_publish(sensor_data, valve_states.get(device_id, False)):
+                    logger.debug(f"Suppressed reading from {device_id} (within dead-band)")
+                    continue
+                
+                if args.dry_run:
+                    # Dry run - just print the data
+                    print(f"[DRY RUN] Would publish to {topic}: {sensor_data.encode()}")
+                    continue
+                
+                if influx_sink:
+                    try:
+                        influx_sink.write(sensor_data, topic)
+                    except SensorRecordError as e:
+                        logger.error(f"Failed to encode reading for InfluxDB: {e}")
+                
+                if forwarder:
+                    # Publish to MQTT broker, or buffer on disk while it is unreachable
+                    payload = sensor_data.encode()
+                    if forwarder.publish(topic, payload):
+                        message_count += 1
+                        log_message(f"Published message #{message_count}: {payload}")
+                    else:
+                        log_message(f"Buffered reading while offline ({len(forwarder.buffer)} buffered)")
+                elif client:
+                    # Publish to MQTT broker
+                    payload = sensor_data.encode()
+                    result = client.publish(topic, payload, qos=1)
+                    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                        message_count += 1
+                        log_message(f"Published message #{message_count}: {payload}")
+                    else:
+                        logger.error(f"Failed to publish message. Error code: {result.rc}")
             
             # Wait for the specified interval
             time.sleep(args.interval)
@@ -243,12 +752,29 @@ def main():
         logger.error(f"Error in main loop: {e}")
         return 1
     finally:
+        if forwarder:
+            forwarder.close()
+            logger.info(f"Offline buffer: {forwarder.buffered} buffered, {forwarder.drained} forwarded, "
+                        f"{forwarder.buffer.dropped} overwritten, {len(forwarder.buffer)} left on disk")
+        
         if client and not args.dry_run:
             logger.info("Disconnecting from MQTT broker...")
             client.loop_stop()
             client.disconnect()
         
-        logger.info(f"=== Soil Sensor Simulator Stopped. Total messages: {message_count} ===")
+        if influx_sink:
+            influx_sink.close()
+        
+        if deadband:
+            logger.info(f"Dead-band: {deadband.summary()}")
+        
+        total = f"{message_count}"
+        if influx_sink:
+            # Sink writes are asynchronous, so only report what InfluxDB acknowledged
+            total = f"{influx_sink.points_written} written to InfluxDB"
+            if use_mqtt:
+                total = f"{message_count} published to MQTT, {total}"
+        logger.info(f"=== Soil Sensor Simulator Stopped. Total messages: {total} ===")
     
     return 0
 